@@ -1,23 +1,83 @@
+import asyncio
+import os
 import shutil
+import sqlite3
 import subprocess
-import hashlib
 import threading
 import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Union, Optional, Dict
-from contextlib import contextmanager
+from typing import Union, Optional, Dict, Tuple
+from contextlib import asynccontextmanager, contextmanager
 
+import numpy as np
+import torch
+import torchaudio as ta
 from fastapi import FastAPI, BackgroundTasks
 from pydantic import BaseModel
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Honour the container's OMP_NUM_THREADS cap unless TORCH_THREADS overrides it
+    threads = int(os.environ.get("TORCH_THREADS") or os.environ.get("OMP_NUM_THREADS") or os.cpu_count() or 1)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # can only be set before the first inter-op parallel work
+    await startup_cleanup()
+    yield
+    await shutdown_cleanup()
+
+
+app = FastAPI(lifespan=lifespan)
 BASE = Path("/var/www/storage/app").resolve()
 
-# In-memory cache for stem separation results
-# Key: hash of input file path, Value: dict with paths and timestamp
-_stem_cache: Dict[str, dict] = {}
-_cache_lock = threading.Lock()
-CACHE_TTL = 3600  # 1 hour cache TTL
+# Segment stems only live until they are moved into BASE, so stage them in RAM
+# (tmpfs) rather than on the shared storage volume when the host has one.
+# Docker's default /dev/shm is only 64MB, so _segment_tmp_base falls back to
+# TMP_DISK whenever TMP_FAST can't hold a segment's stems with headroom.
+TMP_DISK = BASE / "audio/stems"
+TMP_FAST = Path(os.environ.get("DEMUCS_TMP_DIR") or
+                ("/dev/shm/demucs" if Path("/dev/shm").is_dir() else TMP_DISK))
+
+
+def _segment_tmp_base(stem_bytes: int) -> Path:
+    if TMP_FAST != TMP_DISK:
+        try:
+            TMP_FAST.mkdir(parents=True, exist_ok=True)
+            if shutil.disk_usage(TMP_FAST).free > 2 * stem_bytes:
+                return TMP_FAST
+        except OSError:
+            pass
+    return TMP_DISK
+
+# In-memory cache for stem separation results, written through to a sqlite
+# index next to the stems so a restart doesn't force demucs to re-run.
+# Key: (input path, model, two_stems), Value: dict with paths, input mtime and timestamp.
+# Entries stay valid until the input's mtime changes; CACHE_MAX_ENTRIES only caps the size.
+# Only ever touched from the event loop, so it needs no lock; sqlite writes go to a thread.
+CacheKey = Tuple[str, str, str]
+_stem_cache: Dict[CacheKey, dict] = {}
+CACHE_MAX_ENTRIES = 5000  # oldest-written entries beyond this are dropped
+CACHE_SWEEP_INTERVAL = 600  # seconds between size-cap sweeps
+
+_inflight: Dict[CacheKey, asyncio.Event] = {}  # keys currently being separated
+
+_CACHE_DB_PATH = BASE / "audio/stems/.stem_cache.db"
+_CACHE_SCHEMA = 3  # bump to drop the table when the row layout changes
+_db: Optional[sqlite3.Connection] = None
+_db_lock = threading.Lock()
+_sweeper: Optional[asyncio.Task] = None
+
+# Demucs models kept resident so requests don't pay a CLI spawn + model load each
+_models: Dict[str, object] = {}
+_model_lock = threading.Lock()  # one forward at a time; also guards lazy loads
+
+_preflight_result: Optional[dict] = None
+_preflight_lock = threading.Lock()
 
 
 class SeparateReq(BaseModel):
@@ -45,28 +105,210 @@ class ExtractSegmentReq(BaseModel):
     chunk_index: int
 
 
-def _get_cache_key(path: str) -> str:
-    """Generate cache key from file path and modification time."""
-    p = Path(path)
-    if p.exists():
-        mtime = p.stat().st_mtime
-        return hashlib.md5(f"{path}:{mtime}".encode()).hexdigest()
-    return hashlib.md5(path.encode()).hexdigest()
+def _get_cache_key(path: str, model: str, two_stems: str) -> CacheKey:
+    """Cache key: every argument that affects the output (mtime is checked on hit)."""
+    return (path, model, two_stems)
 
 
-def _cleanup_old_cache():
-    """Remove expired cache entries."""
-    now = time.time()
-    with _cache_lock:
-        expired = [k for k, v in _stem_cache.items() if now - v.get('timestamp', 0) > CACHE_TTL]
-        for k in expired:
-            del _stem_cache[k]
+def _cache_size() -> int:
+    return len(_stem_cache)
 
 
-def _audio_backend_preflight(tmp_dir: Path):
-    import torch
-    import torchaudio as ta
+_DELETE_ENTRY_SQL = "DELETE FROM stem_cache WHERE input_path = ? AND model = ? AND two_stems = ?"
+
+
+def _open_cache_db() -> sqlite3.Connection:
+    _CACHE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(_CACHE_DB_PATH), check_same_thread=False, isolation_level=None)
+    if conn.execute("PRAGMA user_version").fetchone()[0] != _CACHE_SCHEMA:
+        conn.execute("DROP TABLE IF EXISTS stem_cache")
+        conn.execute(f"PRAGMA user_version = {_CACHE_SCHEMA}")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS stem_cache ("
+        "input_path TEXT NOT NULL, model TEXT NOT NULL, two_stems TEXT NOT NULL, "
+        "no_vocals_rel TEXT NOT NULL, vocals_rel TEXT, input_mtime INTEGER NOT NULL, ts REAL NOT NULL, "
+        "PRIMARY KEY (input_path, model, two_stems))"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS stem_cache_ts ON stem_cache (ts)")
+    return conn
+
+
+def _load_cache_index():
+    """Populate the in-memory cache from the persisted index."""
+    with _db_lock:
+        rows = _db.execute(
+            "SELECT input_path, model, two_stems, no_vocals_rel, vocals_rel, input_mtime, ts FROM stem_cache"
+        ).fetchall()
+    for *key, no_vocals_rel, vocals_rel, input_mtime, ts in rows:
+        _stem_cache[tuple(key)] = {
+            "ok": True,
+            "no_vocals_rel": no_vocals_rel,
+            "vocals_rel": vocals_rel,
+            "input_mtime": input_mtime,
+            "timestamp": ts,
+        }
+
+
+async def _cache_put(key: CacheKey, entry: dict):
+    """Store a result in memory and write it through to the index."""
+    _stem_cache[key] = entry
+    if _db is not None:
+        await asyncio.to_thread(_db_put, key, entry)
+
+
+def _db_put(key: CacheKey, entry: dict):
+    try:
+        with _db_lock:
+            _db.execute(
+                "INSERT OR REPLACE INTO stem_cache "
+                "(input_path, model, two_stems, no_vocals_rel, vocals_rel, input_mtime, ts) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, entry["no_vocals_rel"], entry.get("vocals_rel"), entry["input_mtime"], entry["timestamp"]),
+            )
+    except sqlite3.Error as e:
+        print(f"Stem cache write failed (continuing uncached): {e}")
+
+
+async def _cache_drop(key: CacheKey):
+    """Invalidate an entry whose input changed since it was cached."""
+    _stem_cache.pop(key, None)
+    if _db is not None:
+        await asyncio.to_thread(_db_drop, key)
+
+
+def _db_drop(key: CacheKey):
+    try:
+        with _db_lock:
+            _db.execute(_DELETE_ENTRY_SQL, key)
+    except sqlite3.Error as e:
+        print(f"Stem cache delete failed: {e}")
+
+
+def _cleanup_old_cache() -> list:
+    """Drop the oldest-written entries beyond CACHE_MAX_ENTRIES from the index; returns their keys."""
+    if _db is None:
+        return []
+    with _db_lock:
+        evicted = [tuple(r) for r in _db.execute(
+            "SELECT input_path, model, two_stems FROM stem_cache ORDER BY ts DESC LIMIT -1 OFFSET ?",
+            (CACHE_MAX_ENTRIES,),
+        )]
+        _db.executemany(_DELETE_ENTRY_SQL, evicted)
+    return evicted
+
+
+async def _cache_sweep_loop():
+    while True:
+        await asyncio.sleep(CACHE_SWEEP_INTERVAL)
+        try:
+            for k in await asyncio.to_thread(_cleanup_old_cache):
+                _stem_cache.pop(k, None)
+        except sqlite3.Error as e:
+            print(f"Stem cache sweep failed: {e}")
+
+
+def _move_file(src: Path, dst: Path):
+    """Rename src over dst (atomic, no bytes copied), copying only across filesystems."""
+    try:
+        os.replace(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+        src.unlink(missing_ok=True)
+
+
+def _move_files(*pairs: Tuple[Path, Path]):
+    """Move several (src, dst) files concurrently; copyfile releases the GIL in sendfile."""
+    with ThreadPoolExecutor(max_workers=len(pairs)) as ex:
+        for f in [ex.submit(_move_file, src, dst) for src, dst in pairs]:
+            f.result()
+
+
+def _drain_tail(stream, buf: bytearray, limit: int):
+    """Read stream to EOF keeping only roughly its last `limit` bytes in buf."""
+    # Read raw chunks rather than lines: progress bars redraw with \r and never end a line
+    while chunk := stream.read1(65536):
+        buf += chunk
+        if len(buf) > 2 * limit:
+            del buf[:-limit]
+
+
+def run_bounded(cmd: list[str], timeout: float, tail: int = 3000) -> tuple[int, str]:
+    """
+    Run cmd with stdout discarded and only the last `tail` bytes of stderr kept,
+    so a chatty child can't grow our memory. Raises TimeoutExpired after killing it.
+    """
+    p = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    err = bytearray()
+    reader = threading.Thread(target=_drain_tail, args=(p.stderr, err, tail), daemon=True)
+    reader.start()
+    try:
+        p.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        p.kill()
+        p.wait()
+        raise
+    finally:
+        reader.join()
+        p.stderr.close()
+    return p.returncode, err[-tail:].decode(errors="replace")
+
+
+def _get_model(name: str):
+    """Load a pretrained demucs model once per process and keep it resident."""
+    model = _models.get(name)
+    if model is None:
+        with _model_lock:
+            model = _models.get(name)
+            if model is None:
+                from demucs.pretrained import get_model
+                model = get_model(name)
+                model.cpu().eval()
+                _models[name] = model
+    return model
+
+
+def _separate_wav(wav, model_name: str, stem: str, jobs: int = 0):
+    """
+    Separate a (channels, samples) tensor already at the model's samplerate.
+    Mirrors `demucs.separate --two-stems=<stem>`: returns (stem, everything_else).
+    """
+    from demucs.apply import apply_model
+
+    model = _get_model(model_name)
+    if stem not in model.sources:
+        raise ValueError(f"Stem {stem!r} not in model sources {model.sources}")
 
+    # Same normalisation the demucs CLI applies before/after the forward pass
+    ref = wav.mean(0)
+    mean, std = ref.mean(), ref.std() + 1e-8
+    with _model_lock, torch.no_grad():
+        sources = apply_model(
+            model, ((wav - mean) / std)[None], device="cpu", progress=False, num_workers=jobs
+        )[0]
+    sources = sources * std + mean
+
+    picked = sources[model.sources.index(stem)]
+    return picked, sources.sum(0) - picked
+
+
+def _audio_backend_preflight(tmp_dir: Path):
+    """
+    Verify torchaudio can write audio. A successful check holds for the
+    process lifetime, so it is memoised; failures are re-checked next call.
+    """
+    global _preflight_result
+    if _preflight_result is not None:
+        return _preflight_result
+    with _preflight_lock:
+        if _preflight_result is None:
+            result = _run_audio_backend_preflight(tmp_dir)
+            if not result["ok"]:
+                return result
+            _preflight_result = result
+    return _preflight_result
+
+
+def _run_audio_backend_preflight(tmp_dir: Path):
     backends = ta.list_audio_backends()
     if not backends:
         return {"ok": False, "error": "No torchaudio audio backends available"}
@@ -83,38 +325,85 @@ def _audio_backend_preflight(tmp_dir: Path):
 
 
 @app.get("/health")
-def health():
-    import torch, torchaudio, numpy
+async def health():
     return {
         "ok": True,
-        "numpy": numpy.__version__,
+        "numpy": np.__version__,
         "torch": torch.__version__,
-        "torchaudio": torchaudio.__version__,
-        "backends": torchaudio.list_audio_backends(),
-        "cache_size": len(_stem_cache),
+        "torchaudio": ta.__version__,
+        "backends": ta.list_audio_backends(),
+        "cache_size": _cache_size(),
     }
 
 
+def _check_two_stems(two_stems: str) -> Optional[dict]:
+    # Outputs are always named and returned as vocals/no_vocals, so any other
+    # stem would be mislabelled; the old CLI path failed these requests too.
+    if two_stems != "vocals":
+        return {"ok": False, "error": f"no_vocals not generated: two_stems={two_stems!r} is not supported, use 'vocals'"}
+    return None
+
+
 @app.post("/separate")
-def separate(req: SeparateReq):
+async def separate(req: SeparateReq):
     """Full file stem separation - used for processing entire videos."""
     inp = (BASE / req.input_rel).resolve()
     if not inp.exists():
         return {"ok": False, "error": f"Input not found: {req.input_rel}"}
+    bad_stem = _check_two_stems(req.two_stems)
+    if bad_stem:
+        return bad_stem
+
+    cache_key = _get_cache_key(str(inp), req.model, req.two_stems)
+    input_mtime = inp.stat().st_mtime_ns
+
+    # If the same key is already being separated, wait for that run instead of
+    # starting a second demucs pass on the same output, then check the cache.
+    # The lookup is synchronous, so nothing between the last _inflight check and
+    # the claim awaits and no lock is needed; the stale row's DB delete waits
+    # until the key is ours.
+    while (running := _inflight.get(cache_key)) is not None:
+        await running.wait()
+    hit, stale = _cached_response(cache_key, input_mtime)
+    if hit:
+        return hit
+
+    done = _inflight[cache_key] = asyncio.Event()
+    try:
+        if stale:
+            await _cache_drop(cache_key)
+        result = await asyncio.to_thread(_separate_uncached, req, inp)
+        if result["ok"]:
+            await _cache_put(cache_key, {
+                **result,
+                'input_mtime': input_mtime,
+                'timestamp': time.time(),
+            })
+        return result
+    finally:
+        if _inflight.get(cache_key) is done:
+            del _inflight[cache_key]
+        done.set()
+
+
+def _cached_response(cache_key: CacheKey, input_mtime: int) -> Tuple[Optional[dict], bool]:
+    """Return (response for a valid cache hit or None, whether the entry was stale)."""
+    cached = _stem_cache.get(cache_key)
+    if not cached:
+        return None, False
+    if cached.get('input_mtime') != input_mtime:
+        return None, True
+    if not Path(BASE / cached.get('no_vocals_rel', '')).exists():
+        return None, False
+    return {
+        "ok": True,
+        "no_vocals_rel": cached['no_vocals_rel'],
+        "vocals_rel": cached.get('vocals_rel'),
+        "cached": True,
+    }, False
 
-    # Check cache first
-    cache_key = _get_cache_key(str(inp))
-    with _cache_lock:
-        if cache_key in _stem_cache:
-            cached = _stem_cache[cache_key]
-            if Path(BASE / cached.get('no_vocals_rel', '')).exists():
-                return {
-                    "ok": True,
-                    "no_vocals_rel": cached['no_vocals_rel'],
-                    "vocals_rel": cached.get('vocals_rel'),
-                    "cached": True,
-                }
 
+def _separate_uncached(req: SeparateReq, inp: Path) -> dict:
     out_tmp = BASE / f"audio/stems/_tmp_{req.video_id}"
     out_final = BASE / f"audio/stems/{req.video_id}"
 
@@ -127,104 +416,90 @@ def separate(req: SeparateReq):
         shutil.rmtree(out_tmp, ignore_errors=True)
         return pre
 
-    cmd = [
-        "python", "-m", "demucs.separate",
-        "-n", req.model,
-        f"--two-stems={req.two_stems}",
-        "-o", str(out_tmp),
-        "--jobs", "2",  # Parallel processing
-        str(inp),
-    ]
-
     try:
-        p = subprocess.run(cmd, capture_output=True, text=True, timeout=1800)
+        from demucs.audio import AudioFile, save_audio
+
+        model = _get_model(req.model)
+        wav = AudioFile(inp).read(streams=0, samplerate=model.samplerate, channels=model.audio_channels)
+        vocals_wav, no_vocals_wav = _separate_wav(wav, req.model, req.two_stems, jobs=2)
     except Exception as e:
+        shutil.rmtree(out_tmp, ignore_errors=True)
         return {"ok": False, "error": f"Demucs execution failed: {e}"}
 
-    if p.returncode != 0:
-        return {
-            "ok": False,
-            "error": "Demucs failed",
-            "stdout": p.stdout[-3000:],
-            "stderr": p.stderr[-3000:],
-        }
-
-    model_dir = out_tmp / req.model / inp.stem
-
-    def pick(name):
-        for ext in (".wav", ".flac"):
-            f = model_dir / f"{name}{ext}"
-            if f.exists():
-                return f
-        return None
-
-    vocals = pick("vocals")
-    no_vocals = pick("no_vocals")
-
-    if not no_vocals:
-        return {"ok": False, "error": "no_vocals not generated"}
-
-    shutil.copyfile(no_vocals, out_final / no_vocals.name)
-    if vocals:
-        shutil.copyfile(vocals, out_final / vocals.name)
-
-    shutil.rmtree(out_tmp, ignore_errors=True)
+    vocals = out_tmp / "vocals.wav"
+    no_vocals = out_tmp / "no_vocals.wav"
+    try:
+        save_audio(no_vocals_wav, no_vocals, samplerate=model.samplerate)
+        save_audio(vocals_wav, vocals, samplerate=model.samplerate)
+        _move_files((no_vocals, out_final / no_vocals.name), (vocals, out_final / vocals.name))
+    except Exception as e:
+        return {"ok": False, "error": f"Writing stems failed: {e}"}
+    finally:
+        shutil.rmtree(out_tmp, ignore_errors=True)
 
-    result = {
+    return {
         "ok": True,
         "no_vocals_rel": f"audio/stems/{req.video_id}/{no_vocals.name}",
-        "vocals_rel": f"audio/stems/{req.video_id}/{vocals.name}" if vocals else None,
+        "vocals_rel": f"audio/stems/{req.video_id}/{vocals.name}",
     }
 
-    # Cache the result
-    with _cache_lock:
-        _stem_cache[cache_key] = {
-            **result,
-            'timestamp': time.time(),
-        }
-
-    return result
-
 
 @app.post("/separate-segment")
-def separate_segment(req: SegmentReq):
+async def separate_segment(req: SegmentReq):
     """
     Optimized stem separation for small segments.
-    Extracts the segment first, then processes only that portion.
+    Decodes just the segment through an ffmpeg pipe and runs demucs
+    in-process on it, so no intermediate segment.wav touches the disk.
     Much faster for small chunks from large movies.
     """
+    return await asyncio.to_thread(_separate_segment, req)
+
+
+def _separate_segment(req: SegmentReq) -> dict:
     inp = (BASE / req.input_rel).resolve()
     if not inp.exists():
         return {"ok": False, "error": f"Input not found: {req.input_rel}"}
+    bad_stem = _check_two_stems(req.two_stems)
+    if bad_stem:
+        return bad_stem
+
+    try:
+        model = _get_model(req.model)
+    except Exception as e:
+        return {"ok": False, "error": f"Demucs model load failed: {e}"}
 
     # For very short segments, use a lighter approach
     segment_id = f"{req.video_id}_seg_{int(req.start_time * 1000)}"
-    out_tmp = BASE / f"audio/stems/_tmp_{segment_id}"
+    stem_bytes = int(2 * req.duration * model.samplerate * model.audio_channels * 2)  # two 16-bit stems
+    out_tmp = _segment_tmp_base(stem_bytes) / f"_tmp_{segment_id}"
     out_final = BASE / f"audio/stems/{req.video_id}"
 
     shutil.rmtree(out_tmp, ignore_errors=True)
     out_tmp.mkdir(parents=True, exist_ok=True)
     out_final.mkdir(parents=True, exist_ok=True)
 
-    # Step 1: Extract just the segment we need (fast with ffmpeg)
-    segment_audio = out_tmp / "segment.wav"
+    # Step 1: Decode just the segment we need straight into memory (fast with ffmpeg)
     extract_cmd = [
         "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
         "-ss", str(req.start_time),
         "-i", str(inp),
         "-t", str(req.duration),
-        "-vn", "-ac", "2", "-ar", "44100", "-c:a", "pcm_s16le",
-        str(segment_audio),
+        "-vn", "-ac", str(model.audio_channels), "-ar", str(model.samplerate),
+        "-f", "f32le", "-c:a", "pcm_f32le",
+        "pipe:1",
     ]
 
     try:
-        p = subprocess.run(extract_cmd, capture_output=True, text=True, timeout=60)
+        p = subprocess.run(extract_cmd, capture_output=True, timeout=60)
         if p.returncode != 0:
-            return {"ok": False, "error": f"Segment extraction failed: {p.stderr[-500:]}"}
+            shutil.rmtree(out_tmp, ignore_errors=True)
+            return {"ok": False, "error": f"Segment extraction failed: {p.stderr.decode(errors='replace')[-500:]}"}
     except Exception as e:
+        shutil.rmtree(out_tmp, ignore_errors=True)
         return {"ok": False, "error": f"Segment extraction error: {e}"}
 
-    if not segment_audio.exists() or segment_audio.stat().st_size < 1000:
+    if len(p.stdout) < 1000:
+        shutil.rmtree(out_tmp, ignore_errors=True)
         return {"ok": False, "error": "Extracted segment is empty or too small"}
 
     pre = _audio_backend_preflight(out_tmp)
@@ -233,109 +508,121 @@ def separate_segment(req: SegmentReq):
         return pre
 
     # Step 2: Run demucs on the small segment (much faster)
-    cmd = [
-        "python", "-m", "demucs.separate",
-        "-n", req.model,
-        f"--two-stems={req.two_stems}",
-        "-o", str(out_tmp),
-        str(segment_audio),
-    ]
+    samples = np.frombuffer(p.stdout, dtype=np.float32).reshape(-1, model.audio_channels)
+    wav = torch.from_numpy(samples.T.copy())
 
     try:
-        # Shorter timeout for segments
-        timeout = max(60, int(req.duration * 10))  # ~10x realtime max
-        p = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
-    except subprocess.TimeoutExpired:
-        shutil.rmtree(out_tmp, ignore_errors=True)
-        return {"ok": False, "error": "Segment separation timed out"}
+        vocals_wav, no_vocals_wav = _separate_wav(wav, req.model, req.two_stems)
     except Exception as e:
         shutil.rmtree(out_tmp, ignore_errors=True)
         return {"ok": False, "error": f"Demucs execution failed: {e}"}
 
-    if p.returncode != 0:
-        shutil.rmtree(out_tmp, ignore_errors=True)
-        return {
-            "ok": False,
-            "error": "Demucs failed",
-            "stdout": p.stdout[-1000:],
-            "stderr": p.stderr[-1000:],
-        }
-
-    model_dir = out_tmp / req.model / "segment"
-
-    def pick(name):
-        for ext in (".wav", ".flac"):
-            f = model_dir / f"{name}{ext}"
-            if f.exists():
-                return f
-        return None
+    from demucs.audio import save_audio
 
-    vocals = pick("vocals")
-    no_vocals = pick("no_vocals")
+    vocals = out_tmp / "vocals.wav"
+    no_vocals = out_tmp / "no_vocals.wav"
 
-    if not no_vocals:
-        shutil.rmtree(out_tmp, ignore_errors=True)
-        return {"ok": False, "error": "no_vocals not generated for segment"}
-
-    # Copy to final location with unique segment name
+    # Move to final location with unique segment name
     output_name = f"no_vocals_chunk_{req.video_id}_{int(req.start_time * 1000)}.wav"
-    vocals_name = f"vocals_chunk_{req.video_id}_{int(req.start_time * 1000)}.wav" if vocals else None
-
-    shutil.copyfile(no_vocals, out_final / output_name)
-    if vocals:
-        shutil.copyfile(vocals, out_final / vocals_name)
+    vocals_name = f"vocals_chunk_{req.video_id}_{int(req.start_time * 1000)}.wav"
 
-    shutil.rmtree(out_tmp, ignore_errors=True)
+    try:
+        save_audio(no_vocals_wav, no_vocals, samplerate=model.samplerate)
+        save_audio(vocals_wav, vocals, samplerate=model.samplerate)
+        _move_files((no_vocals, out_final / output_name), (vocals, out_final / vocals_name))
+    except Exception as e:
+        return {"ok": False, "error": f"Writing stems failed: {e}"}
+    finally:
+        shutil.rmtree(out_tmp, ignore_errors=True)
 
     return {
         "ok": True,
         "no_vocals_rel": f"audio/stems/{req.video_id}/{output_name}",
-        "vocals_rel": f"audio/stems/{req.video_id}/{vocals_name}" if vocals else None,
+        "vocals_rel": f"audio/stems/{req.video_id}/{vocals_name}",
         "segment": True,
         "duration": req.duration,
     }
 
 
+def _find_stems(stems_dir: Path) -> Dict[str, os.DirEntry]:
+    """
+    Locate the full-track vocals / no_vocals stems with one directory scan
+    instead of an exists() stat per name and extension. Prefers .wav over .flac.
+    """
+    found: Dict[str, os.DirEntry] = {}
+    try:
+        with os.scandir(stems_dir) as it:
+            for entry in it:
+                name, _, ext = entry.name.rpartition(".")
+                if name in ("vocals", "no_vocals") and ext in ("wav", "flac"):
+                    if ext == "wav" or name not in found:
+                        found[name] = entry
+    except FileNotFoundError:
+        pass
+    return found
+
+
+def _slice_pcm_wav(src: Path, dst: Path, start: float, duration: float,
+                   rate: int = 44100, channels: int = 2) -> bool:
+    """
+    Copy a time range out of a 16-bit PCM WAV without decoding it.
+    Returns False (writing nothing) when src isn't 16-bit PCM at rate/channels,
+    so the caller can fall back to ffmpeg.
+    """
+    try:
+        with wave.open(str(src), "rb") as r:
+            if (r.getsampwidth(), r.getframerate(), r.getnchannels()) != (2, rate, channels):
+                return False
+            r.setpos(min(int(start * rate), r.getnframes()))
+            frames = r.readframes(int(duration * rate))
+    except (wave.Error, EOFError):
+        return False
+
+    with wave.open(str(dst), "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(frames)
+    return True
+
+
 @app.post("/extract-from-stems")
 def extract_from_stems(req: ExtractSegmentReq):
     """
     Extract a segment from already-separated full stems.
     This is VERY fast when full stems are already available.
-    No ML processing needed - just ffmpeg extraction.
+    No ML processing needed - a raw sample copy, or ffmpeg for non-PCM stems.
     """
     stems_dir = BASE / f"audio/stems/{req.video_id}"
 
     # Find the no_vocals file
-    no_vocals_path = None
-    for ext in (".wav", ".flac"):
-        candidate = stems_dir / f"no_vocals{ext}"
-        if candidate.exists():
-            no_vocals_path = candidate
-            break
-
-    if not no_vocals_path:
+    no_vocals = _find_stems(stems_dir).get("no_vocals")
+    if not no_vocals:
         return {"ok": False, "error": "Full stems not found - run /separate first"}
+    no_vocals_path = Path(no_vocals.path)
 
     # Output path for this chunk's segment
     output_name = f"bg_chunk_{req.chunk_index}.wav"
     output_path = stems_dir / output_name
 
-    # Extract just the segment we need (very fast - no ML)
-    extract_cmd = [
-        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
-        "-ss", str(req.start_time),
-        "-i", str(no_vocals_path),
-        "-t", str(req.duration),
-        "-c:a", "pcm_s16le", "-ar", "44100", "-ac", "2",
-        str(output_path),
-    ]
-
-    try:
-        p = subprocess.run(extract_cmd, capture_output=True, text=True, timeout=30)
-        if p.returncode != 0:
-            return {"ok": False, "error": f"Segment extraction failed: {p.stderr[-500:]}"}
-    except Exception as e:
-        return {"ok": False, "error": f"Extraction error: {e}"}
+    # Extract just the segment we need (very fast - no ML).
+    # Stems demucs wrote are already in the target format, so just copy the samples.
+    if not _slice_pcm_wav(no_vocals_path, output_path, req.start_time, req.duration):
+        extract_cmd = [
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+            "-ss", str(req.start_time),
+            "-i", str(no_vocals_path),
+            "-t", str(req.duration),
+            "-c:a", "pcm_s16le", "-ar", "44100", "-ac", "2",
+            str(output_path),
+        ]
+
+        try:
+            code, err = run_bounded(extract_cmd, timeout=30, tail=500)
+            if code != 0:
+                return {"ok": False, "error": f"Segment extraction failed: {err}"}
+        except Exception as e:
+            return {"ok": False, "error": f"Extraction error: {e}"}
 
     if not output_path.exists() or output_path.stat().st_size < 100:
         return {"ok": False, "error": "Extracted segment is empty"}
@@ -356,16 +643,12 @@ def check_stems_ready(video_id: Union[int, str]):
     """
     stems_dir = BASE / f"audio/stems/{video_id}"
 
-    if not stems_dir.exists():
-        return {"ready": False}
-
-    for ext in (".wav", ".flac"):
-        candidate = stems_dir / f"no_vocals{ext}"
-        if candidate.exists() and candidate.stat().st_size > 1000:
-            return {
-                "ready": True,
-                "no_vocals_rel": f"audio/stems/{video_id}/no_vocals{ext}",
-            }
+    no_vocals = _find_stems(stems_dir).get("no_vocals")
+    if no_vocals and no_vocals.stat().st_size > 1000:
+        return {
+            "ready": True,
+            "no_vocals_rel": f"audio/stems/{video_id}/{no_vocals.name}",
+        }
 
     return {"ready": False}
 
@@ -387,15 +670,10 @@ def extract_vocals(req: ExtractVocalsReq):
     stems_dir = BASE / f"audio/stems/{req.video_id}"
 
     # Find the vocals file
-    vocals_path = None
-    for ext in (".wav", ".flac"):
-        candidate = stems_dir / f"vocals{ext}"
-        if candidate.exists():
-            vocals_path = candidate
-            break
-
-    if not vocals_path:
+    vocals = _find_stems(stems_dir).get("vocals")
+    if not vocals:
         return {"ok": False, "error": "Vocals stem not found - run full stem separation first"}
+    vocals_path = Path(vocals.path)
 
     # Output path for this speaker's voice sample
     samples_dir = BASE / f"audio/voice_samples/{req.video_id}"
@@ -416,9 +694,9 @@ def extract_vocals(req: ExtractVocalsReq):
     ]
 
     try:
-        p = subprocess.run(extract_cmd, capture_output=True, text=True, timeout=30)
-        if p.returncode != 0:
-            return {"ok": False, "error": f"Vocals extraction failed: {p.stderr[-500:]}"}
+        code, err = run_bounded(extract_cmd, timeout=30, tail=500)
+        if code != 0:
+            return {"ok": False, "error": f"Vocals extraction failed: {err}"}
     except Exception as e:
         return {"ok": False, "error": f"Extraction error: {e}"}
 
@@ -432,19 +710,42 @@ def extract_vocals(req: ExtractVocalsReq):
     }
 
 
-@app.on_event("startup")
 async def startup_cleanup():
-    """Clean up old temp directories and cache on startup."""
-    stems_base = BASE / "audio/stems"
-    if stems_base.exists():
-        for d in stems_base.iterdir():
-            if d.is_dir() and d.name.startswith("_tmp_"):
-                shutil.rmtree(d, ignore_errors=True)
+    """Clean up old temp directories; pre-load the model, audio backend check and cache index."""
+    global _db, _sweeper
+    stems_base = TMP_DISK
+    for tmp_base in {stems_base, TMP_FAST}:
+        if tmp_base.exists():
+            for d in tmp_base.iterdir():
+                if d.is_dir() and d.name.startswith("_tmp_"):
+                    shutil.rmtree(d, ignore_errors=True)
+
+    try:
+        await asyncio.to_thread(_get_model, "htdemucs")
+    except Exception as e:
+        print(f"Demucs model pre-load failed (will load on first request): {e}")
+
+    stems_base.mkdir(parents=True, exist_ok=True)
+    pre = await asyncio.to_thread(_audio_backend_preflight, stems_base)
+    if not pre["ok"]:
+        print(f"Audio backend preflight failed (will retry per request): {pre['error']}")
+
+    try:
+        _db = _open_cache_db()
+        _cleanup_old_cache()
+        _load_cache_index()
+    except sqlite3.Error as e:
+        print(f"Stem cache index unavailable (using memory only): {e}")
+        _db = None
+    _sweeper = asyncio.create_task(_cache_sweep_loop())
 
 
-@app.on_event("shutdown")
 async def shutdown_cleanup():
-    """Clean cache on shutdown."""
-    global _stem_cache
-    with _cache_lock:
-        _stem_cache.clear()
+    """Stop the sweeper and close the cache index (entries persist for the next start)."""
+    global _db
+    if _sweeper is not None:
+        _sweeper.cancel()
+    with _db_lock:
+        if _db is not None:
+            _db.close()
+            _db = None
@@ -3,10 +3,15 @@ Demucs GPU service for RunPod.
 Accepts audio file uploads, runs GPU-accelerated stem separation, returns stems.
 Uses demucs Python API directly (no subprocess) to avoid PyTorch in-place op issues.
 """
+import asyncio
 import hashlib
+import mmap
+import os
 import shutil
 import tempfile
+import threading
 import time
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 from pathlib import Path
 
@@ -17,11 +22,58 @@ import torchaudio
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.responses import FileResponse
 
+try:
+    from blake3 import blake3 as _hasher
+except ImportError:
+    # stdlib fallback: blake2b is still several times faster than md5 on 64-bit
+    _hasher = hashlib.blake2b
+
+_IO_BLOCK = 1 << 20  # 1 MiB writes amortise syscall overhead on large uploads
+
+# Uploads are staged in RAM when /dev/shm exists and has room; /tmp on RunPod
+# images is container disk, not tmpfs. Stems still go to the on-disk cache below.
+_WORK_DIR = os.environ.get("DEMUCS_WORK_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+
+def _work_dir_for(upload_bytes: int | None) -> str | None:
+    """_WORK_DIR if it can hold the upload with headroom, else the default temp dir."""
+    # Docker's default /dev/shm is 64MB, far less than a full-length upload
+    if _WORK_DIR is None or not upload_bytes:
+        return None
+    try:
+        return _WORK_DIR if shutil.disk_usage(_WORK_DIR).free > 2 * upload_bytes else None
+    except OSError:
+        return None
+
 _cache_dir = Path("/tmp/demucs_cache")
 _cache_dir.mkdir(exist_ok=True)
 
-_model = None
+# /tmp on RunPod is small, so finished stems are kept under a byte budget and
+# the least recently used entries are dropped on insert. The OrderedDict is the
+# LRU index (job_id -> bytes, oldest first), so inserts never stat the whole dir.
+MAX_CACHE_BYTES = int(float(os.environ.get("DEMUCS_MAX_CACHE_GB", "10")) * 1024**3)
+_cache_index: "OrderedDict[str, int]" = OrderedDict()
+_cache_bytes = 0
+_cache_index_lock = threading.Lock()
+
+_models: dict = {}  # model name -> resident demucs model
+_model_lock = threading.Lock()  # one forward at a time on the single GPU; also guards loads
 _device = "cuda" if torch.cuda.is_available() else "cpu"
+# FP16 autocast on GPU (DEMUCS_FP16=1) runs convs/matmuls on tensor cores. Opt-in
+# until stem quality is checked against FP32: the decoder output the iSTFT sees
+# can come out as ComplexHalf under autocast.
+_use_fp16 = _device == "cuda" and os.environ.get("DEMUCS_FP16", "0") == "1"
+
+# Micro-batching: concurrent /separate calls arriving within BATCH_WINDOW are
+# stacked into one apply_model forward. Long inputs skip the queue, since
+# padding a short clip up to a long one would waste more than batching saves.
+MAX_BATCH = int(os.environ.get("DEMUCS_MAX_BATCH", "4"))
+BATCH_WINDOW = float(os.environ.get("DEMUCS_BATCH_WINDOW_MS", "10")) / 1000
+BATCH_MAX_SECONDS = float(os.environ.get("DEMUCS_BATCH_MAX_SECONDS", "60"))
+_batch_queue: asyncio.Queue | None = None
+_batch_task: asyncio.Task | None = None
+
+_inflight: dict[str, asyncio.Event] = {}  # cache keys currently being separated
 
 
 def _load_model(name: str = "htdemucs"):
@@ -32,9 +84,19 @@ def _load_model(name: str = "htdemucs"):
     return m
 
 
+def _get_model(name: str = "htdemucs"):
+    model = _models.get(name)
+    if model is None:
+        with _model_lock:
+            model = _models.get(name)
+            if model is None:
+                model = _models[name] = _load_model(name)
+    return model
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global _model
+    global _batch_queue, _batch_task
     print("=== Demucs GPU Service Starting ===")
     if torch.cuda.is_available():
         print(f"GPU: {torch.cuda.get_device_name(0)}")
@@ -43,23 +105,81 @@ async def lifespan(app: FastAPI):
         print("WARNING: No GPU detected, will use CPU (slow)")
     try:
         print("Loading htdemucs model...")
-        _model = _load_model("htdemucs")
+        _get_model("htdemucs")
         print("Model loaded successfully")
     except Exception as e:
         print(f"Model pre-load failed (will load on first request): {e}")
+    _index_existing_cache()
+    _batch_queue = asyncio.Queue()
+    _batch_task = asyncio.create_task(_batch_loop())
     yield
+    _batch_task.cancel()
     shutil.rmtree(_cache_dir, ignore_errors=True)
 
 
 app = FastAPI(title="Demucs GPU Service", lifespan=lifespan)
 
 
-def _get_file_hash(file_path: Path) -> str:
-    h = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()
+def _dir_bytes(d: Path) -> int:
+    return sum(f.stat().st_size for f in d.iterdir() if f.is_file())
+
+
+def _index_existing_cache():
+    """Seed the LRU index from entries left on disk, oldest mtime first."""
+    global _cache_bytes
+    entries = sorted((d for d in _cache_dir.iterdir() if d.is_dir()), key=lambda d: d.stat().st_mtime)
+    with _cache_index_lock:
+        for d in entries:
+            size = _dir_bytes(d)
+            _cache_index[d.name] = size
+            _cache_bytes += size
+
+
+def _cache_touch(job_id: str):
+    with _cache_index_lock:
+        if job_id in _cache_index:
+            _cache_index.move_to_end(job_id)
+
+
+def _cache_forget(job_id: str):
+    global _cache_bytes
+    with _cache_index_lock:
+        _cache_bytes -= _cache_index.pop(job_id, 0)
+
+
+def _cache_add(job_id: str, cached_dir: Path):
+    """Record a new entry, then evict least recently used ones until under budget."""
+    global _cache_bytes
+    evict = []
+    with _cache_index_lock:
+        _cache_bytes -= _cache_index.pop(job_id, 0)
+        size = _dir_bytes(cached_dir)
+        _cache_index[job_id] = size
+        _cache_bytes += size
+        while _cache_bytes > MAX_CACHE_BYTES and len(_cache_index) > 1:
+            old_id, old_size = _cache_index.popitem(last=False)
+            _cache_bytes -= old_size
+            evict.append(old_id)
+    for old_id in evict:
+        shutil.rmtree(_cache_dir / old_id, ignore_errors=True)
+
+
+def _hash_file_sync(file_path: Path) -> str:
+    # Hashing the mapping directly avoids copying the file through userspace buffers
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return _hasher(mm).hexdigest()[:32]
+
+
+async def _get_file_hash(file_path: Path) -> str:
+    """Content hash of an upload, used only as a cache key (not for integrity)."""
+    return await asyncio.to_thread(_hash_file_sync, file_path)
+
+
+def _save_upload(audio: UploadFile, dest: Path):
+    """Copy an upload to disk in _IO_BLOCK chunks instead of buffering it all in RAM."""
+    audio.file.seek(0)
+    with open(dest, "wb") as f:
+        shutil.copyfileobj(audio.file, f, _IO_BLOCK)
 
 
 def _load_audio_to_tensor(audio_path: Path) -> tuple[torch.Tensor, int]:
@@ -96,34 +216,87 @@ def _load_audio_to_tensor(audio_path: Path) -> tuple[torch.Tensor, int]:
     return wav, sr
 
 
-def _separate(wav: torch.Tensor, sr: int, model_name: str = "htdemucs") -> tuple[torch.Tensor, torch.Tensor]:
+def _separate_batch(wavs: list[torch.Tensor], model_name: str = "htdemucs") -> list[tuple[torch.Tensor, torch.Tensor]]:
     """
-    Run demucs separation. Returns (vocals, no_vocals) tensors, shape (2, samples).
+    Run demucs separation on (2, samples) tensors already at the model's samplerate.
+    Inputs are zero-padded to the longest and run as one (B, 2, samples) forward.
+    Returns one (vocals, no_vocals) pair per input, trimmed back to its own length.
     """
-    global _model
     from demucs.apply import apply_model
 
-    if _model is None:
-        _model = _load_model(model_name)
+    model = _get_model(model_name)
+    lengths = [w.shape[-1] for w in wavs]
+    max_len = max(lengths)
+    wav_batch = torch.stack([
+        torch.nn.functional.pad(w, (0, max_len - n)) for w, n in zip(wavs, lengths)
+    ]).to(_device)  # (B, 2, samples)
+
+    with _model_lock, torch.no_grad(), torch.autocast("cuda", dtype=torch.float16, enabled=_use_fp16):
+        sources = apply_model(model, wav_batch, device=_device, progress=False, overlap=0.5)
+    # sources: (B, num_stems, 2, samples)
+    sources = sources.float().cpu()
 
-    target_sr = _model.samplerate
+    source_names = model.sources  # e.g. ['drums', 'bass', 'other', 'vocals']
+    vocals_idx = source_names.index("vocals")
+    results = []
+    for i, n in enumerate(lengths):
+        item = sources[i, :, :, :n]                   # (num_stems, 2, samples)
+        vocals = item[vocals_idx]                     # (2, samples)
+        results.append((vocals, item.sum(0) - vocals))
+    return results
+
+
+async def _batch_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await _batch_queue.get()]
+        deadline = loop.time() + BATCH_WINDOW
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(_batch_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        by_model: dict[str, list] = {}
+        for item in batch:
+            by_model.setdefault(item[0], []).append(item)
+
+        for model_name, items in by_model.items():
+            try:
+                results = await asyncio.to_thread(_separate_batch, [wav for _, wav, _ in items], model_name)
+            except Exception as e:
+                for _, _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, _, fut), result in zip(items, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+
+def _prepare_input(input_path: Path, model_name: str) -> tuple[torch.Tensor, int]:
+    """Decode an upload and resample it to the model's samplerate (worker thread)."""
+    wav, sr = _load_audio_to_tensor(input_path)
+    target_sr = _get_model(model_name).samplerate
     if sr != target_sr:
         wav = torchaudio.functional.resample(wav, sr, target_sr)
+    return wav, target_sr
 
-    wav = wav.to(_device)
-    wav_batch = wav.unsqueeze(0)  # (1, 2, samples)
-
-    with torch.no_grad():
-        sources = apply_model(_model, wav_batch, device=_device, progress=False, overlap=0.5)
-    # sources: (1, num_stems, 2, samples)
-    sources = sources[0].cpu()  # (num_stems, 2, samples)
 
-    source_names = _model.sources  # e.g. ['drums', 'bass', 'other', 'vocals']
-    vocals_idx = source_names.index("vocals")
-    vocals = sources[vocals_idx]                      # (2, samples)
-    no_vocals = sources.sum(0) - vocals               # (2, samples)
+async def _separate(wav: torch.Tensor, sr: int, model_name: str = "htdemucs") -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Run demucs separation on a (2, samples) tensor already at the model's
+    samplerate `sr`. Returns (vocals, no_vocals) tensors, shape (2, samples).
+    """
+    if _batch_queue is None or wav.shape[-1] > BATCH_MAX_SECONDS * sr:
+        return (await asyncio.to_thread(_separate_batch, [wav], model_name))[0]
 
-    return vocals, no_vocals
+    fut = asyncio.get_running_loop().create_future()
+    await _batch_queue.put((model_name, wav, fut))
+    return await fut
 
 
 @app.get("/health")
@@ -134,8 +307,10 @@ def health():
         "gpu": torch.cuda.is_available(),
         "gpu_name": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
         "torch_version": torch.__version__,
-        "model_loaded": _model is not None,
-        "cache_size": len(list(_cache_dir.iterdir())) if _cache_dir.exists() else 0,
+        "model_loaded": bool(_models),
+        "fp16": _use_fp16,
+        "cache_size": len(_cache_index),
+        "cache_bytes": _cache_bytes,
     }
 
 
@@ -145,55 +320,79 @@ async def separate(
     model: str = Form("htdemucs"),
     two_stems: str = Form("vocals"),
 ):
-    work_dir = Path(tempfile.mkdtemp(prefix="demucs_"))
+    work_dir = Path(tempfile.mkdtemp(prefix="demucs_", dir=_work_dir_for(getattr(audio, "size", None))))
     try:
         input_path = work_dir / f"input{Path(audio.filename or 'audio.wav').suffix}"
-        with open(input_path, "wb") as f:
-            f.write(await audio.read())
+        await asyncio.to_thread(_save_upload, audio, input_path)
 
         if input_path.stat().st_size < 1000:
             raise HTTPException(status_code=400, detail="Audio file too small")
 
-        file_hash = _get_file_hash(input_path)
+        file_hash = await _get_file_hash(input_path)
         cache_key = f"{file_hash}_{model}_{two_stems}"
         cached_dir = _cache_dir / cache_key
 
-        if cached_dir.exists() and (cached_dir / "no_vocals.wav").exists():
-            return {
-                "ok": True,
-                "cached": True,
-                "job_id": cache_key,
-                "no_vocals_url": f"/download/{cache_key}/no_vocals.wav",
-                "vocals_url": f"/download/{cache_key}/vocals.wav" if (cached_dir / "vocals.wav").exists() else None,
-            }
+        # Identical uploads arriving together wait for the first one's result
+        # rather than separating the same audio again.
+        while (running := _inflight.get(cache_key)) is not None:
+            await running.wait()
+        hit = _cached_response(cache_key)
+        if hit:
+            return hit
 
-        start_time = time.time()
+        done = _inflight[cache_key] = asyncio.Event()
+        try:
+            return await _separate_uncached(input_path, model, cache_key, cached_dir)
+        finally:
+            del _inflight[cache_key]
+            done.set()
 
-        wav, sr = _load_audio_to_tensor(input_path)
-        vocals, no_vocals = _separate(wav, sr, model)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-        elapsed = time.time() - start_time
 
-        cached_dir.mkdir(parents=True, exist_ok=True)
+def _cached_response(cache_key: str) -> dict | None:
+    cached_dir = _cache_dir / cache_key
+    if not (cached_dir / "no_vocals.wav").exists():
+        return None
+    _cache_touch(cache_key)
+    return {
+        "ok": True,
+        "cached": True,
+        "job_id": cache_key,
+        "no_vocals_url": f"/download/{cache_key}/no_vocals.wav",
+        "vocals_url": f"/download/{cache_key}/vocals.wav" if (cached_dir / "vocals.wav").exists() else None,
+    }
 
-        def _save(tensor: torch.Tensor, path: Path):
-            data = tensor.numpy().T  # (samples, channels)
-            sf.write(str(path), data, _model.samplerate)
 
-        _save(no_vocals, cached_dir / "no_vocals.wav")
-        _save(vocals, cached_dir / "vocals.wav")
+def _store_stems(vocals: torch.Tensor, no_vocals: torch.Tensor, sr: int, cache_key: str, cached_dir: Path):
+    """Write both stems into the cache entry and account for it (may evict old entries)."""
+    cached_dir.mkdir(parents=True, exist_ok=True)
+    sf.write(str(cached_dir / "no_vocals.wav"), no_vocals.numpy().T, sr)  # (samples, channels)
+    sf.write(str(cached_dir / "vocals.wav"), vocals.numpy().T, sr)
+    _cache_add(cache_key, cached_dir)
 
-        return {
-            "ok": True,
-            "cached": False,
-            "job_id": cache_key,
-            "elapsed_seconds": round(elapsed, 2),
-            "no_vocals_url": f"/download/{cache_key}/no_vocals.wav",
-            "vocals_url": f"/download/{cache_key}/vocals.wav",
-        }
 
-    finally:
-        shutil.rmtree(work_dir, ignore_errors=True)
+async def _separate_uncached(input_path: Path, model: str, cache_key: str, cached_dir: Path) -> dict:
+    start_time = time.time()
+
+    # Decode, resample and the stem writes all run off the loop, so concurrent
+    # uploads reach the batch queue within one window instead of one by one.
+    wav, sr = await asyncio.to_thread(_prepare_input, input_path, model)
+    vocals, no_vocals = await _separate(wav, sr, model)
+
+    elapsed = time.time() - start_time
+
+    await asyncio.to_thread(_store_stems, vocals, no_vocals, sr, cache_key, cached_dir)
+
+    return {
+        "ok": True,
+        "cached": False,
+        "job_id": cache_key,
+        "elapsed_seconds": round(elapsed, 2),
+        "no_vocals_url": f"/download/{cache_key}/no_vocals.wav",
+        "vocals_url": f"/download/{cache_key}/vocals.wav",
+    }
 
 
 @app.get("/download/{job_id}/{filename}")
@@ -203,6 +402,7 @@ def download(job_id: str, filename: str):
     file_path = _cache_dir / job_id / filename
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found")
+    _cache_touch(job_id)
     return FileResponse(path=file_path, media_type="audio/wav", filename=filename)
 
 
@@ -211,6 +411,7 @@ def delete_cache(job_id: str):
     cached_dir = _cache_dir / job_id
     if cached_dir.exists():
         shutil.rmtree(cached_dir, ignore_errors=True)
+        _cache_forget(job_id)
         return {"ok": True, "deleted": True}
     return {"ok": True, "deleted": False}
 
@@ -222,6 +423,7 @@ def cleanup_cache(max_age_hours: int = 2):
     for entry in _cache_dir.iterdir():
         if entry.is_dir() and now - entry.stat().st_mtime > max_age_hours * 3600:
             shutil.rmtree(entry, ignore_errors=True)
+            _cache_forget(entry.name)
             deleted += 1
     return {"ok": True, "deleted_entries": deleted}
 
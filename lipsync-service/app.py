@@ -1,5 +1,7 @@
+import json
 import os
 import subprocess
+import threading
 import time
 from fastapi import FastAPI
 from pydantic import BaseModel
@@ -32,16 +34,47 @@ def abs_path(rel: str) -> str:
     rel = rel.lstrip("/").strip()
     return os.path.join(APP_STORAGE, rel)
 
+LOG_TAIL = 16000
+
+def _drain_tail(stream, buf: bytearray, limit: int):
+    # Chunked reads, not lines: progress bars redraw with \r and never end a line
+    while chunk := stream.read1(65536):
+        buf += chunk
+        if len(buf) > 2 * limit:
+            del buf[:-limit]
+
 def run(cmd: list[str], timeout: int = 3600) -> tuple[int, str, float]:
     t0 = time.time()
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    # Only the tail is ever returned, so keep just that much of the child's output
+    # instead of buffering the whole run (Wav2Lip progress output is large).
+    out = bytearray()
+    reader = threading.Thread(target=_drain_tail, args=(p.stdout, out, LOG_TAIL), daemon=True)
+    reader.start()
     try:
-        out, _ = p.communicate(timeout=timeout)
+        code = p.wait(timeout=timeout)
     except subprocess.TimeoutExpired:
         p.kill()
-        out, _ = p.communicate()
-        return 124, out[-16000:], time.time() - t0
-    return p.returncode, out[-16000:], time.time() - t0
+        p.wait()
+        code = 124
+    reader.join()
+    p.stdout.close()
+    return code, out[-LOG_TAIL:].decode(errors="replace"), time.time() - t0
+
+def is_16k_mono_wav(path: str) -> bool:
+    """True if path is already the PCM 16k mono wav Wav2Lip wants (so no resample needed)."""
+    if not path.lower().endswith(".wav"):
+        return False  # inference.py re-encodes anything not named .wav
+    try:
+        p = subprocess.run([
+            "ffprobe", "-v", "error", "-select_streams", "a:0",
+            "-show_entries", "stream=codec_name,sample_rate,channels", "-of", "json", path
+        ], capture_output=True, timeout=30)
+        streams = json.loads(p.stdout or b"{}").get("streams") or [{}]
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        return False
+    s = streams[0]
+    return s.get("codec_name") == "pcm_s16le" and s.get("sample_rate") == "16000" and s.get("channels") == 1
 
 @app.post("/lipsync")
 def lipsync(req: Req):
@@ -62,13 +95,17 @@ def lipsync(req: Req):
     tmp_dir = os.path.dirname(out_mp4)
     tmp_wav = os.path.join(tmp_dir, "audio_16k_mono.wav")
 
-    code, log1, dt1 = run([
-        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
-        "-i", in_wav, "-ac", "1", "-ar", "16000", tmp_wav
-    ], timeout=600)
+    if is_16k_mono_wav(in_wav):
+        w2l_wav = in_wav
+    else:
+        w2l_wav = tmp_wav
+        code, log1, dt1 = run([
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+            "-i", in_wav, "-ac", "1", "-ar", "16000", tmp_wav
+        ], timeout=600)
 
-    if code != 0 or not os.path.exists(tmp_wav):
-        return {"ok": False, "error": "ffmpeg wav resample failed", "code": code, "seconds": dt1, "log": log1}
+        if code != 0 or not os.path.exists(tmp_wav):
+            return {"ok": False, "error": "ffmpeg wav resample failed", "code": code, "seconds": dt1, "log": log1}
 
     # Wav2Lip CPU stability knobs:
     # - face_det_batch_size=1 reduces RAM spikes significantly
@@ -83,7 +120,7 @@ def lipsync(req: Req):
         "python", os.path.join(W2L_DIR, "inference.py"),
         "--checkpoint_path", CKPT,
         "--face", in_mp4,
-        "--audio", tmp_wav,
+        "--audio", w2l_wav,
         "--outfile", tmp_w2l,
         "--pads", "0", "10", "0", "0",
         "--resize_factor", "2",
@@ -9,13 +9,19 @@ import os
 # Configure logging to show in uvicorn
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+import asyncio
+import hashlib
 import traceback
 import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from typing import Optional, Dict, Any, Tuple
 
 import numpy as np
 import soundfile as sf
 import librosa
+import soxr
 import torch
 
 # Heavy imports are kept, but model construction is lazy.
@@ -44,7 +50,13 @@ if HF_TOKEN:
 
 # You can override these via env if you want
 WHISPER_MODEL_NAME = os.environ.get("WHISPER_MODEL", "base")
-WHISPER_COMPUTE_TYPE = os.environ.get("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_COMPUTE_TYPE = os.environ.get(
+    "WHISPER_COMPUTE_TYPE", "int8_float16" if DEVICE.startswith("cuda") else "int8"
+)
+# Diarization runs alongside transcription, so CTranslate2 gets half the cores by default
+CT2_CPU_THREADS = int(os.environ.get("CT2_CPU_THREADS", max(1, (os.cpu_count() or 4) // 2)))
+CT2_WORKERS = int(os.environ.get("CT2_WORKERS", "1"))
+WHISPER_BEAM = int(os.environ.get("WHISPER_BEAM", "1"))  # greedy; set 5 for faster-whisper's default beam
 DIARIZATION_MODEL = os.environ.get("DIARIZATION_MODEL", "pyannote/speaker-diarization-3.1")
 GENDER_MODEL_ID = os.environ.get(
     "GENDER_MODEL_ID",
@@ -62,17 +74,19 @@ EMOTION_MODEL_ID = os.environ.get(
 ENABLE_DIARIZATION = os.environ.get("ENABLE_DIARIZATION", "1") == "1" and bool(HF_TOKEN)
 ENABLE_GENDER = os.environ.get("ENABLE_GENDER", "1") == "1"  # STATUS: Flow 2 only
 ENABLE_EMOTION = os.environ.get("ENABLE_EMOTION", "1") == "1"  # STATUS: Flow 2 only
-
-app = FastAPI()
+# Dynamic INT8 for the wav2vec2 gender/emotion encoders (CPU only; set 0 for FP32)
+WAV2VEC2_INT8 = os.environ.get("WAV2VEC2_INT8", "1") == "1" and DEVICE == "cpu"
 
 # ---------------- STATE (lazy singletons) ----------------
 _state_lock = threading.Lock()
 
 _whisper_model: Optional[WhisperModel] = None
 _diarize_pipeline: Optional[DiarizationPipeline] = None
-_align_model: Optional[Any] = None
-_align_metadata: Optional[Dict] = None
-_align_language: Optional[str] = None
+# language -> (align model, metadata), most recently used last. Concurrent
+# analyses can need different languages, so models are kept per language
+# instead of one global pair that each request would swap out.
+ALIGN_CACHE_SIZE = int(os.environ.get("ALIGN_CACHE_SIZE", "2"))
+_align_models: "OrderedDict[str, Tuple[Any, Dict]]" = OrderedDict()
 
 _gender_ok: bool = False
 _gender_extractor: Optional[Any] = None
@@ -110,41 +124,52 @@ def resolve_audio_path(p: str) -> str:
 
 
 def load_audio_mono_16k(path: str):
-    y, sr = librosa.load(path, sr=16000, mono=True)
-    return y.astype(np.float32), 16000
-
-
-def concat_speaker_audio(full_y, sr, speaker_rows, min_total_sec=1.2, max_total_sec=25.0):
-    clips = []
-    total = 0.0
-    for r in speaker_rows:
-        st = float(r["start"])
-        en = float(r["end"])
+    # libsndfile decodes wav/flac/ogg (and mp3 on 1.1+) in C; anything it can't
+    # open (m4a, video containers) goes through librosa's audioread path.
+    try:
+        y, sr = sf.read(path, dtype="float32", always_2d=False)
+    except (sf.LibsndfileError, RuntimeError):
+        y, sr = librosa.load(path, sr=16000, mono=True)
+        return y.astype(np.float32), 16000
+    if y.ndim > 1:
+        y = y.mean(axis=1, dtype=np.float32)
+    if sr != 16000:
+        y = soxr.resample(y, sr, 16000)
+    return np.ascontiguousarray(y, dtype=np.float32), 16000
+
+
+def concat_speaker_audio(full_y, sr, speaker_turns, min_total_sec=1.2, max_total_sec=25.0):
+    """Join a speaker's (start, end) turns, in seconds, into one clip capped at max_total_sec."""
+    # Copy turns straight into one buffer instead of collecting slices and concatenating
+    buf = np.empty(int(max_total_sec * sr), dtype=np.float32)
+    off = 0
+    for st, en in speaker_turns:
         if en <= st:
             continue
         a = int(st * sr)
         b = int(en * sr)
         if a >= len(full_y):
             continue
-        b = min(b, len(full_y))
-        clip = full_y[a:b]
-        if clip.size == 0:
+        b = min(b, len(full_y), a + buf.size - off)
+        if b <= a:
             continue
-        clips.append(clip)
-        total += (b - a) / sr
-        if total >= max_total_sec:
+        buf[off:off + b - a] = full_y[a:b]
+        off += b - a
+        if off >= buf.size:
             break
-    if total < min_total_sec:
+    if off < min_total_sec * sr:
         return None
-    return np.concatenate(clips)
+    return buf[:off]
 
 
 def estimate_age_group_from_pitch(y_16k: np.ndarray, sr: int = 16000):
     try:
-        f0, voiced_flag, voiced_prob = librosa.pyin(
-            y_16k, fmin=50, fmax=500, sr=sr, frame_length=2048, hop_length=256
-        )
-        f0v = f0[~np.isnan(f0)]
+        # Plain YIN + an energy gate instead of pyin: only the median of voiced f0
+        # feeds a 4-way bucket, so pyin's Viterbi decoding buys nothing here.
+        f0 = librosa.yin(y_16k, fmin=50, fmax=500, sr=sr, frame_length=2048, hop_length=512)
+        rms = librosa.feature.rms(y=y_16k, frame_length=2048, hop_length=512)[0]
+        n = min(len(f0), len(rms))
+        f0v = f0[:n][rms[:n] > 0.5 * rms.mean()]
         if f0v.size < 20:
             return "unknown", None
         med = float(np.median(f0v))
@@ -160,6 +185,13 @@ def estimate_age_group_from_pitch(y_16k: np.ndarray, sr: int = 16000):
 
 
 # ---------------- LAZY MODEL INIT ----------------
+def _quantize_int8(module: torch.nn.Module) -> torch.nn.Module:
+    """Swap Linear layers for dynamic-INT8 ones; the bulk of wav2vec2's CPU time is in them."""
+    if not WAV2VEC2_INT8:
+        return module
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
 def get_whisper_model() -> WhisperModel:
     global _whisper_model
     if _whisper_model is not None:
@@ -170,6 +202,8 @@ def get_whisper_model() -> WhisperModel:
                 WHISPER_MODEL_NAME,
                 device=DEVICE,
                 compute_type=WHISPER_COMPUTE_TYPE,
+                cpu_threads=CT2_CPU_THREADS,
+                num_workers=CT2_WORKERS,
             )
     return _whisper_model
 
@@ -221,27 +255,26 @@ def get_diarize_pipeline() -> Optional[DiarizationPipeline]:
 
 
 def get_align_model(language_code: str):
-    """Lazy-load whisperx alignment model. Reloads if language changes."""
-    global _align_model, _align_metadata, _align_language
-    if _align_model is not None and _align_language == language_code:
-        return _align_model, _align_metadata
+    """Lazy-load the whisperx alignment model for a language (LRU of ALIGN_CACHE_SIZE)."""
     with _state_lock:
-        if _align_model is not None and _align_language == language_code:
-            return _align_model, _align_metadata
+        entry = _align_models.get(language_code)
+        if entry is not None:
+            _align_models.move_to_end(language_code)
+            return entry
         try:
             print(f"[ALIGN] Loading alignment model for '{language_code}' on {DEVICE}", flush=True)
-            _align_model, _align_metadata = whisperx.load_align_model(
+            entry = whisperx.load_align_model(
                 language_code=language_code,
                 device=DEVICE,
             )
-            _align_language = language_code
             print(f"[ALIGN] Model loaded successfully", flush=True)
         except Exception as e:
             print(f"[ALIGN] Failed to load alignment model: {e}", flush=True)
-            _align_model = None
-            _align_metadata = None
-            _align_language = None
-    return _align_model, _align_metadata
+            return None, None
+        _align_models[language_code] = entry
+        while len(_align_models) > max(1, ALIGN_CACHE_SIZE):
+            _align_models.popitem(last=False)
+        return entry
 
 
 def init_gender_model_if_needed() -> Tuple[bool, Optional[str]]:
@@ -258,8 +291,7 @@ def init_gender_model_if_needed() -> Tuple[bool, Optional[str]]:
             return True, None
         try:
             _gender_extractor = AutoFeatureExtractor.from_pretrained(GENDER_MODEL_ID)
-            _gender_model = Wav2Vec2ForSequenceClassification.from_pretrained(GENDER_MODEL_ID)
-            _gender_model.eval()
+            _gender_model = _quantize_int8(Wav2Vec2ForSequenceClassification.from_pretrained(GENDER_MODEL_ID).eval())
             _gender_ok = True
             return True, None
         except Exception as e:
@@ -286,6 +318,8 @@ def init_emotion_model_if_needed() -> Tuple[bool, Optional[str]]:
                 source=EMOTION_MODEL_ID,
                 run_opts={"device": DEVICE},
             )
+            if "wav2vec2" in _emotion_clf.mods:
+                _emotion_clf.mods.wav2vec2 = _quantize_int8(_emotion_clf.mods.wav2vec2.eval())
             _emotion_ok = True
             return True, None
         except Exception as e:
@@ -294,75 +328,183 @@ def init_emotion_model_if_needed() -> Tuple[bool, Optional[str]]:
             return False, str(e)
 
 
-def predict_gender(y_16k: np.ndarray, sr: int = 16000):
+def _gender_label(best: int, id2label: dict) -> str:
+    label = str(id2label.get(best, "unknown")).lower()
+
+    if "female" in label or label in ("f", "woman"):
+        return "female"
+    if "male" in label or label in ("m", "man"):
+        return "male"
+
+    # fallback
+    if best == 0:
+        return "female"
+    if best == 1:
+        return "male"
+
+    return "unknown"
+
+
+# Re-analysing the same audio yields byte-identical speaker clips, so their
+# gender/emotion results are memoised by clip hash (per head, LRU-bounded).
+CLIP_CACHE_SIZE = int(os.environ.get("CLIP_CACHE_SIZE", "256"))
+_clip_cache: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+_clip_cache_lock = threading.Lock()
+
+
+def _clip_hash(y: np.ndarray) -> str:
+    return hashlib.blake2b(y.tobytes(), digest_size=16).hexdigest()
+
+
+def _per_clip_cached(head: str, clips: list, predict) -> list:
+    """Answer cached clips from memory and run predict() on the rest as one batch."""
+    keys = [(head, _clip_hash(y)) for y in clips]
+    with _clip_cache_lock:
+        results = [_clip_cache.get(k) for k in keys]
+        for k, r in zip(keys, results):
+            if r is not None:
+                _clip_cache.move_to_end(k)
+
+    misses = [i for i, r in enumerate(results) if r is None]
+    if misses:
+        fresh = predict([clips[i] for i in misses])
+        with _clip_cache_lock:
+            for i, r in zip(misses, fresh):
+                results[i] = r
+                if r[1] is not None:  # don't pin fallbacks from a failed forward
+                    _clip_cache[keys[i]] = r
+            while len(_clip_cache) > CLIP_CACHE_SIZE:
+                _clip_cache.popitem(last=False)
+    return results
+
+
+def _by_length(clips: list, predict_batch) -> list:
+    """
+    Run predict_batch once per group of equal-length clips, so no row is padded.
+    Neither speaker model masks padding (the SpeechBrain wav2vec2 encoder ignores
+    wav_lens), so a zero-padded clip's result would depend on its batch-mates.
+    Clips capped at concat_speaker_audio's max_total_sec share one length,
+    which is where batching pays off.
+    """
+    groups: Dict[int, list] = defaultdict(list)
+    for i, y in enumerate(clips):
+        groups[len(y)].append(i)
+    results = [None] * len(clips)
+    for idx in groups.values():
+        for i, r in zip(idx, predict_batch([clips[i] for i in idx])):
+            results[i] = r
+    return results
+
+
+def predict_genders(clips: list, sr: int = 16000) -> list:
+    """Gender for every speaker clip, uncached ones batched by equal length."""
+    return _per_clip_cached("gender", clips, lambda batch: _predict_genders(batch, sr))
+
+
+def predict_emotions(clips: list, sr: int = 16000) -> list:
+    """Emotion for every speaker clip, uncached ones batched by equal length."""
+    return _per_clip_cached("emotion", clips, lambda batch: _predict_emotions(batch, sr))
+
+
+def _predict_genders(clips: list, sr: int) -> list:
     ok, err = init_gender_model_if_needed()
     if not ok:
-        return "unknown", None
+        return [("unknown", None)] * len(clips)
+    return _by_length(clips, lambda batch: _gender_batch(batch, sr))
 
-    try:
-        inputs = _gender_extractor(y_16k, sampling_rate=sr, return_tensors="pt", padding=True)
-        with torch.no_grad():
-            logits = _gender_model(**inputs).logits
-            probs = torch.softmax(logits, dim=-1).cpu().numpy()[0]
-        best = int(np.argmax(probs))
-        conf = float(probs[best])
 
+def _gender_batch(clips: list, sr: int) -> list:
+    try:
+        inputs = _gender_extractor(clips, sampling_rate=sr, return_tensors="pt")
+        with _infer_sem, torch.inference_mode():
+            probs = torch.softmax(_gender_model(**inputs).logits, dim=-1)
+            confs, best = probs.max(dim=-1)
         id2label = getattr(_gender_model.config, "id2label", {}) or {}
-        label = str(id2label.get(best, "unknown")).lower()
-
-        if "female" in label or label in ("f", "woman"):
-            return "female", conf
-        if "male" in label or label in ("m", "man"):
-            return "male", conf
+        return [(_gender_label(b, id2label), c) for b, c in zip(best.tolist(), confs.tolist())]
+    except Exception:
+        return [("unknown", None)] * len(clips)
 
-        # fallback
-        if best == 0:
-            return "female", conf
-        if best == 1:
-            return "male", conf
 
-        return "unknown", conf
-    except Exception:
-        return "unknown", None
+_EMOTION_LABELS = {
+    "neu": "neutral",
+    "hap": "happy",
+    "sad": "sad",
+    "ang": "angry",
+    "fea": "fear",
+    "exc": "excited",
+    "fru": "frustration",
+    "sur": "surprise",
+}
 
 
-def predict_emotion(tmp_wav_path: str):
+def _predict_emotions(clips: list, sr: int) -> list:
     ok, err = init_emotion_model_if_needed()
     if not ok:
-        return "neutral", None
+        return [("neutral", None)] * len(clips)
+    return _by_length(clips, _emotion_batch)
+
 
+def _emotion_batch(clips: list) -> list:
     try:
-        out_prob, score, index, text_lab = _emotion_clf.classify_file(tmp_wav_path)
-        lab = text_lab[0] if isinstance(text_lab, (list, tuple)) and len(text_lab) else str(text_lab)
-        lab = str(lab).lower()
-
-        mapping = {
-            "neu": "neutral",
-            "hap": "happy",
-            "sad": "sad",
-            "ang": "angry",
-            "fea": "fear",
-            "exc": "excited",
-            "fru": "frustration",
-            "sur": "surprise",
-        }
-        emotion = mapping.get(lab, lab)
+        # Clips are already 16k mono in memory and all the same length, so
+        # they stack into one unpadded batch and skip classify_file's decode.
+        wavs = torch.from_numpy(np.stack(clips))
+        wav_lens = torch.ones(len(clips))
+
+        with _infer_sem, torch.inference_mode():
+            out_prob, score, index, text_lab = _emotion_clf.classify_batch(wavs, wav_lens)
+        if not isinstance(text_lab, (list, tuple)):
+            text_lab = [text_lab]
+        confs = out_prob.reshape(len(clips), -1).max(dim=-1).values.tolist()
+
+        return [(_EMOTION_LABELS.get(str(lab).lower(), str(lab).lower()), conf)
+                for lab, conf in zip(text_lab, confs)]
+    except Exception:
+        return [("neutral", None)] * len(clips)
+
+
+def _warmup():
+    """Load every enabled model up front so the first request doesn't pay the cold start."""
+    get_whisper_model()
+    if ENABLE_DIARIZATION and get_diarize_pipeline() is None:
+        logger.warning("Diarization pipeline failed to load at startup")
+    for name, init in (("gender", init_gender_model_if_needed), ("emotion", init_emotion_model_if_needed)):
+        ok, err = init()
+        if not ok and err != "disabled":
+            logger.warning(f"{name} model failed to load at startup: {err}")
+
 
-        conf = None
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if DEVICE == "cpu":
+        torch.set_num_threads(int(os.environ.get("TORCH_THREADS") or os.cpu_count() or 4))
         try:
-            if hasattr(out_prob, "max"):
-                conf = float(out_prob.max().item())
-        except Exception:
-            conf = None
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # can only be set before the first inter-op parallel work
+
+    # Loaded models are never replaced, so the getters' lock-free fast path is
+    # the only one requests take once this has run.
+    try:
+        await asyncio.to_thread(_warmup)
+    except Exception as e:
+        logger.warning(f"Model warmup failed (will load on first request): {e}")
+    yield
 
-        return emotion, conf
-    except Exception:
-        return "neutral", None
 
+app = FastAPI(lifespan=lifespan)
 
-# Semaphore allows 2 concurrent GPU operations on RTX 3090 (24GB VRAM).
-# Models are shared singletons; only per-request tensors use extra VRAM (~1-2GB each).
-_analyze_semaphore = threading.Semaphore(2)
+
+# Bounds concurrent model forwards — transcribe, diarize, align and the batched
+# gender/emotion passes (2 fit an RTX 3090's 24GB VRAM). Models are shared
+# singletons; only per-request tensors use extra VRAM (~1-2GB each).
+# Decoding, assignment, pitch tracking and cache lookups run outside it.
+ANALYZE_CONCURRENCY = int(os.environ.get("ANALYZE_CONCURRENCY", "2"))
+_infer_sem = threading.BoundedSemaphore(ANALYZE_CONCURRENCY)
+
+# One diarization per concurrent analysis; pitch tracking is pure numpy DSP
+_diarize_pool = ThreadPoolExecutor(max_workers=ANALYZE_CONCURRENCY, thread_name_prefix="diarize")
+_pitch_pool = ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2), thread_name_prefix="pitch")
 
 
 @app.get("/health")
@@ -375,11 +517,13 @@ def health():
         "enable_gender": ENABLE_GENDER,
         "enable_emotion": ENABLE_EMOTION,
         "whisper_loaded": _whisper_model is not None,
-        "align_loaded": _align_model is not None,
-        "align_language": _align_language,
+        "align_loaded": bool(_align_models),
+        "align_language": next(reversed(_align_models), None),
+        "align_languages": list(_align_models),
         "diarize_loaded": _diarize_pipeline is not None,
         "gender_loaded": _gender_ok,
         "emotion_loaded": _emotion_ok,
+        "wav2vec2_int8": WAV2VEC2_INT8,
     }
 
 
@@ -459,29 +603,149 @@ def _merge_segments(segments: list, max_gap: float = 0.5) -> list:
     return merged
 
 
+# Diarization turns as parallel columns: starts, ends (float64 seconds) and speakers (str objects)
+DiarCols = Tuple[np.ndarray, np.ndarray, np.ndarray]
+_NO_DIAR: DiarCols = (np.empty(0), np.empty(0), np.empty(0, dtype=object))
+
+
+def _diarize(audio: np.ndarray, min_speakers: Optional[int], max_speakers: Optional[int]) -> Tuple[DiarCols, str]:
+    """Run diarization; returns (columns, status) and degrades gracefully if unavailable."""
+    diar = _NO_DIAR
+    try:
+        diarize = get_diarize_pipeline()
+        if diarize is not None:
+            diarize_kwargs = {}
+            if min_speakers is not None:
+                diarize_kwargs["min_speakers"] = min_speakers
+            if max_speakers is not None:
+                diarize_kwargs["max_speakers"] = max_speakers
+
+            # Let pyannote decide speaker count naturally.
+            # Previously auto-hinted min_speakers=2 for long audio, but this
+            # forced multiple speakers on single-speaker videos.
+            # Callers can still pass min_speakers/max_speakers explicitly.
+
+            print(f"[DIARIZE] Calling with kwargs: {diarize_kwargs}", flush=True)
+            with _infer_sem:
+                diarization_df = diarize(audio, **diarize_kwargs)
+            diar = (
+                diarization_df["start"].to_numpy(dtype=np.float64),
+                diarization_df["end"].to_numpy(dtype=np.float64),
+                diarization_df["speaker"].astype(str).to_numpy(dtype=object),
+            )
+            diarization_status = "ok"
+
+            # Debug: log diarization results
+            unique_speakers = set(diar[2])
+            print(f"[DIARIZE] Found {len(diar[0])} speaker segments, {len(unique_speakers)} unique speakers: {sorted(unique_speakers)}", flush=True)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Diar rows (first 30): %s", [
+                    f"{st:.2f}-{en:.2f} -> {spk}" for st, en, spk in zip(*(c[:30] for c in diar))
+                ])
+        else:
+            diarization_status = "pipeline_unavailable"
+            print("[DIARIZE] Pipeline not available, skipping diarization", flush=True)
+    except Exception as e:
+        diarization_status = f"error: {e}"
+        print(f"[DIARIZE] Failed: {e}, continuing without diarization", flush=True)
+        traceback.print_exc()
+        diar = _NO_DIAR
+    return diar, diarization_status
+
+
+def _assign_speakers(segments: list, diar: DiarCols) -> list:
+    """Label each segment with the diarization speaker it overlaps most (nearest midpoint if none).
+
+    Runs once over the final segment list: alignment rewrites the transcript's
+    timestamps and diarization is still running while whisper decodes, so there
+    is nothing to assign against until both have finished.
+    """
+    diar_starts, diar_ends, diar_speakers = diar
+    n_diar = len(diar_starts)
+    final_segments = []
+    if n_diar:
+        print(f"[ASSIGN] Assigning speakers to {len(segments)} transcription segments from {n_diar} diar rows", flush=True)
+        diar_mids = 0.5 * (diar_starts + diar_ends)
+        seg_starts = np.fromiter((float(s["start"]) for s in segments), dtype=np.float64, count=len(segments))
+        seg_ends = np.fromiter((float(s["end"]) for s in segments), dtype=np.float64, count=len(segments))
+
+        # (segments x diar rows) overlap matrix; argmax keeps the first row on ties
+        overlaps = np.maximum(
+            0.0,
+            np.minimum(seg_ends[:, None], diar_ends) - np.maximum(seg_starts[:, None], diar_starts),
+        )
+        best_rows = overlaps.argmax(axis=1)
+        best_overlaps = overlaps[np.arange(len(segments)), best_rows]
+
+        # Fallback: if no overlap found, use closest speaker by midpoint
+        no_overlap = best_overlaps == 0.0
+        if no_overlap.any():
+            seg_mids = 0.5 * (seg_starts[no_overlap] + seg_ends[no_overlap])
+            mid_dists = np.abs(seg_mids[:, None] - diar_mids)
+            best_rows[no_overlap] = mid_dists.argmin(axis=1)
+            min_dists = np.zeros(len(segments))
+            min_dists[no_overlap] = mid_dists.min(axis=1)
+
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for i, seg in enumerate(segments):
+            best_speaker = diar_speakers[best_rows[i]]
+            if debug:
+                if no_overlap[i]:
+                    logger.debug("[ASSIGN] Seg[%.2f-%.2f] NO OVERLAP, closest=%s, min_dist=%.2fs",
+                                 seg_starts[i], seg_ends[i], best_speaker, min_dists[i])
+                else:
+                    logger.debug("[ASSIGN] Seg[%.2f-%.2f] overlap=%.2fs -> %s",
+                                 seg_starts[i], seg_ends[i], best_overlaps[i], best_speaker)
+
+            final_segments.append({**seg, "speaker": best_speaker})
+    else:
+        print("[ASSIGN] No diarization rows - assigning all to SPEAKER_0", flush=True)
+        for seg in segments:
+            final_segments.append({**seg, "speaker": "SPEAKER_0"})
+    return final_segments
+
+
 def _analyze_audio(audio_path: str, min_speakers: Optional[int] = None, max_speakers: Optional[int] = None, lite: bool = False, language: Optional[str] = None) -> dict:
     """Core analysis logic shared by path-based and upload endpoints."""
-    # 1) TRANSCRIBE
+    # Decode once; transcription, alignment, diarization and speaker meta all
+    # take the 16k mono array instead of each re-reading the file.
+    full_y, sr = load_audio_mono_16k(audio_path)
+
+    # 1) DIARIZE (optional) — it doesn't depend on the transcript, so it runs on a
+    # worker thread while we transcribe and align; CTranslate2 and torch both
+    # release the GIL. Always run diarization when enabled — lite mode only
+    # skips gender/emotion ML.
+    f_diar = _diarize_pool.submit(_diarize, full_y, min_speakers, max_speakers) if ENABLE_DIARIZATION else None
+
+    # 2) TRANSCRIBE
     whisper_model = get_whisper_model()
-    transcribe_kwargs = {"vad_filter": True}
+    transcribe_kwargs = {
+        "vad_filter": True,
+        "vad_parameters": {"min_silence_duration_ms": 500},
+        "beam_size": WHISPER_BEAM,
+        # Stops long-audio hallucination loops and saves prompt decode steps
+        "condition_on_previous_text": False,
+    }
     if language:
         transcribe_kwargs["language"] = language
-    whisper_segments, info = whisper_model.transcribe(audio_path, **transcribe_kwargs)
-    segments = [
-        {"start": float(s.start), "end": float(s.end), "text": s.text.strip()}
-        for s in whisper_segments
-    ]
-
-    # 2) ALIGN — fix segment timestamps using whisperx forced alignment
+    with _infer_sem:
+        # transcribe() is lazy; decoding happens while the generator is consumed
+        whisper_segments, info = whisper_model.transcribe(full_y, **transcribe_kwargs)
+        segments = [
+            {"start": float(s.start), "end": float(s.end), "text": s.text.strip()}
+            for s in whisper_segments
+        ]
+
+    # 3) ALIGN — fix segment timestamps using whisperx forced alignment
     language = language or getattr(info, "language", "en") or "en"
     if segments:
         try:
             align_model, align_metadata = get_align_model(language)
             if align_model is not None:
-                audio_array = whisperx.load_audio(audio_path)
-                aligned = whisperx.align(
-                    segments, align_model, align_metadata, audio_array, DEVICE,
-                )
+                with _infer_sem:
+                    aligned = whisperx.align(
+                        segments, align_model, align_metadata, full_y, DEVICE,
+                    )
                 aligned_segs = aligned.get("segments", [])
                 if aligned_segs:
                     raw_aligned = [
@@ -502,140 +766,60 @@ def _analyze_audio(audio_path: str, min_speakers: Optional[int] = None, max_spea
             print(f"[ALIGN] Alignment failed: {e}, keeping raw timestamps", flush=True)
             traceback.print_exc()
 
-    # 3) DIARIZE (optional - gracefully degrade if unavailable)
-    # Always run diarization when enabled — lite mode only skips gender/emotion ML.
-    diar_rows = []
-    diarization_status = "disabled"  # Track what actually happened
-    if ENABLE_DIARIZATION:
-        try:
-            diarize = get_diarize_pipeline()
-            if diarize is not None:
-                diarize_kwargs = {}
-                if min_speakers is not None:
-                    diarize_kwargs["min_speakers"] = min_speakers
-                if max_speakers is not None:
-                    diarize_kwargs["max_speakers"] = max_speakers
-
-                # Let pyannote decide speaker count naturally.
-                # Previously auto-hinted min_speakers=2 for long audio, but this
-                # forced multiple speakers on single-speaker videos.
-                # Callers can still pass min_speakers/max_speakers explicitly.
-
-                print(f"[DIARIZE] Calling with kwargs: {diarize_kwargs}", flush=True)
-                diarization_df = diarize(audio_path, **diarize_kwargs)
-                diar_rows = diarization_df.to_dict("records")
-                diarization_status = "ok"
-
-                # Debug: log diarization results
-                unique_speakers = set(r["speaker"] for r in diar_rows)
-                print(f"[DIARIZE] Found {len(diar_rows)} speaker segments, {len(unique_speakers)} unique speakers: {sorted(unique_speakers)}", flush=True)
-                for i, row in enumerate(diar_rows[:30]):  # limit to 30 for readability
-                    print(f"  Diar[{i}]: {row['start']:.2f}-{row['end']:.2f} -> {row['speaker']}", flush=True)
-            else:
-                diarization_status = "pipeline_unavailable"
-                print("[DIARIZE] Pipeline not available, skipping diarization", flush=True)
-        except Exception as e:
-            diarization_status = f"error: {e}"
-            print(f"[DIARIZE] Failed: {e}, continuing without diarization", flush=True)
-            traceback.print_exc()
-            diar_rows = []
+    diar, diarization_status = f_diar.result() if f_diar is not None else (_NO_DIAR, "disabled")
+    diar_starts, diar_ends, diar_speakers = diar
+    n_diar = len(diar_starts)
 
-    # 3) Assign speaker to each segment using overlap-based matching
-    final_segments = []
+    # 4) Assign speaker to each segment using overlap-based matching
     print(f"[WHISPER] Found {len(segments)} transcription segments", flush=True)
-    for i, seg in enumerate(segments[:30]):
-        print(f"  Seg[{i}]: {seg['start']:.2f}-{seg['end']:.2f} text='{seg['text'][:50]}...'", flush=True)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Segments (first 30): %s", [
+            f"{seg['start']:.2f}-{seg['end']:.2f} text='{seg['text'][:50]}...'" for seg in segments[:30]
+        ])
 
-    if diar_rows:
-        print(f"[ASSIGN] Assigning speakers to {len(segments)} transcription segments", flush=True)
-        for seg in segments:
-            seg_start = float(seg["start"])
-            seg_end = float(seg["end"])
-
-            # Find speaker with maximum overlap
-            best_speaker = "SPEAKER_UNKNOWN"
-            best_overlap = 0.0
-
-            for row in diar_rows:
-                row_start = float(row["start"])
-                row_end = float(row["end"])
-
-                # Calculate overlap
-                overlap_start = max(seg_start, row_start)
-                overlap_end = min(seg_end, row_end)
-                overlap = max(0.0, overlap_end - overlap_start)
-
-                if overlap > best_overlap:
-                    best_overlap = overlap
-                    best_speaker = str(row["speaker"])
-
-            # Fallback: if no overlap found, use closest speaker by midpoint
-            if best_overlap == 0.0:
-                seg_mid = (seg_start + seg_end) / 2
-                min_dist = float("inf")
-                for row in diar_rows:
-                    row_mid = (float(row["start"]) + float(row["end"])) / 2
-                    dist = abs(seg_mid - row_mid)
-                    if dist < min_dist:
-                        min_dist = dist
-                        best_speaker = str(row["speaker"])
-                print(f"  [ASSIGN] Seg[{seg_start:.2f}-{seg_end:.2f}] NO OVERLAP, closest={best_speaker}, min_dist={min_dist:.2f}s", flush=True)
-            else:
-                print(f"  [ASSIGN] Seg[{seg_start:.2f}-{seg_end:.2f}] overlap={best_overlap:.2f}s -> {best_speaker}", flush=True)
+    final_segments = _assign_speakers(segments, diar)
 
-            final_segments.append({**seg, "speaker": best_speaker})
-    else:
-        print("[ASSIGN] No diarization rows - assigning all to SPEAKER_0", flush=True)
-        for seg in segments:
-            final_segments.append({**seg, "speaker": "SPEAKER_0"})
-
-    # 4) Speaker-level meta (optional / safe defaults)
+    # 5) Speaker-level meta (optional / safe defaults)
     speakers: Dict[str, Dict[str, Any]] = {}
-    if diar_rows:
-        full_y, sr = load_audio_mono_16k(audio_path)
-
-        by_spk: Dict[str, list] = {}
-        for r in diar_rows:
-            spk = str(r.get("speaker", "SPEAKER_UNKNOWN"))
-            by_spk.setdefault(spk, []).append({
-                "start": float(r["start"]),
-                "end": float(r["end"]),
-            })
+    if n_diar:
+        by_spk: Dict[str, list] = defaultdict(list)
+        for spk, st, en in zip(diar_speakers, diar_starts.tolist(), diar_ends.tolist()):
+            by_spk[spk].append((st, en))
 
+        clips: Dict[str, np.ndarray] = {}
         for spk, rows in by_spk.items():
+            # Placeholder keeps speakers in diarization order; filled in below if audible
+            speakers[spk] = {
+                "gender": "unknown",
+                "gender_confidence": None,
+                "age_group": "unknown",
+                "pitch_median_hz": None,
+                "emotion": "neutral",
+                "emotion_confidence": None,
+            }
             y_spk = concat_speaker_audio(full_y, sr, rows)
-            if y_spk is None:
-                speakers[spk] = {
-                    "gender": "unknown",
-                    "gender_confidence": None,
-                    "age_group": "unknown",
-                    "pitch_median_hz": None,
-                    "emotion": "neutral",
-                    "emotion_confidence": None,
-                }
-                continue
-
-            # Pitch estimation is fast (pure DSP, no ML) — always run it
-            age_group, pitch_med = estimate_age_group_from_pitch(y_spk, sr=sr)
-
+            if y_spk is not None:
+                clips[spk] = y_spk
+
+        # Gender and emotion run once over all speakers' clips, not once per speaker.
+        # Lite mode: skip heavy ML models (gender, emotion) for speed.
+        # Used for chunked processing where proxy timeouts are tight.
+        # Gender is inferred cross-chunk via pitch proximity in PHP.
+        pitches = [_pitch_pool.submit(estimate_age_group_from_pitch, y, sr) for y in clips.values()]
+        n = len(clips)
+        genders = [("unknown", None)] * n
+        emotions = [("neutral", None)] * n
+        if clips and not lite:
+            if ENABLE_GENDER:
+                genders = predict_genders(list(clips.values()), sr=sr)
+            if ENABLE_EMOTION:
+                emotions = predict_emotions(list(clips.values()), sr=sr)
+
+        # Pitch estimation is fast (pure DSP, no ML) — always run it
+        for spk, pitch, (gender, gconf), (emotion, econf) in zip(clips, pitches, genders, emotions):
+            age_group, pitch_med = pitch.result()
             if lite:
-                # Lite mode: skip heavy ML models (gender, emotion) for speed.
-                # Used for chunked processing where proxy timeouts are tight.
-                # Gender is inferred cross-chunk via pitch proximity in PHP.
-                gender, gconf = "unknown", None
-                emotion, econf = "neutral", None
                 print(f"  [LITE] Speaker {spk}: pitch={pitch_med}, age={age_group} (skipped gender/emotion)", flush=True)
-            else:
-                gender, gconf = predict_gender(y_spk, sr=sr) if ENABLE_GENDER else ("unknown", None)
-                emotion, econf = ("neutral", None)
-                if ENABLE_EMOTION:
-                    tmp_path = f"/tmp/spk_{spk.replace('/', '_')}.wav"
-                    sf.write(tmp_path, y_spk, sr)
-                    emotion, econf = predict_emotion(tmp_path)
-                    try:
-                        os.remove(tmp_path)
-                    except Exception:
-                        pass
 
             speakers[spk] = {
                 "gender": gender,
@@ -661,28 +845,31 @@ def _analyze_audio(audio_path: str, min_speakers: Optional[int] = None, max_spea
         "speakers": speakers,
         "diarization_enabled": ENABLE_DIARIZATION,
         "diarization_status": diarization_status,
-        "diarization_segments": len(diar_rows),
+        "diarization_segments": n_diar,
         "speakers_detected": len(speakers),
     }
 
 
 @app.post("/analyze")
-def analyze(req: AnalyzeRequest):
+async def analyze(req: AnalyzeRequest):
     """Analyze audio by file path (requires shared filesystem)."""
-    with _analyze_semaphore:
-        try:
-            audio_path = resolve_audio_path(req.audio_path)
-            is_lite = bool(req.lite)
-            return _analyze_audio(audio_path, min_speakers=req.min_speakers, max_speakers=req.max_speakers, lite=is_lite)
-        except HTTPException:
-            raise
-        except Exception as e:
-            traceback.print_exc()
-            return {"error": "whisperx_internal_error", "message": str(e)}
+    return await asyncio.to_thread(_analyze_path, req)
+
+
+def _analyze_path(req: AnalyzeRequest) -> dict:
+    try:
+        audio_path = resolve_audio_path(req.audio_path)
+        is_lite = bool(req.lite)
+        return _analyze_audio(audio_path, min_speakers=req.min_speakers, max_speakers=req.max_speakers, lite=is_lite)
+    except HTTPException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        return {"error": "whisperx_internal_error", "message": str(e)}
 
 
 @app.post("/analyze-upload")
-def analyze_upload(
+async def analyze_upload(
     audio: UploadFile = File(...),
     min_speakers: Optional[int] = Form(None),
     max_speakers: Optional[int] = Form(None),
@@ -690,26 +877,30 @@ def analyze_upload(
     language: Optional[str] = Form(None),
 ):
     """Analyze audio via file upload (for remote clients without shared filesystem)."""
-    with _analyze_semaphore:
-        tmp_path = None
-        try:
-            # Save uploaded file to temp location
-            suffix = os.path.splitext(audio.filename or "audio.wav")[1] or ".wav"
-            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir="/tmp") as tmp:
-                shutil.copyfileobj(audio.file, tmp)
-                tmp_path = tmp.name
-
-            is_lite = bool(lite)
-            print(f"[UPLOAD] Received {audio.filename}, saved to {tmp_path} ({os.path.getsize(tmp_path)} bytes), lite={is_lite}, language={language}", flush=True)
-            return _analyze_audio(tmp_path, min_speakers=min_speakers, max_speakers=max_speakers, lite=is_lite, language=language)
-        except HTTPException:
-            raise
-        except Exception as e:
-            traceback.print_exc()
-            return {"error": "whisperx_internal_error", "message": str(e)}
-        finally:
-            if tmp_path and os.path.exists(tmp_path):
-                try:
-                    os.remove(tmp_path)
-                except Exception:
-                    pass
+    return await asyncio.to_thread(_analyze_upload, audio, min_speakers, max_speakers, lite, language)
+
+
+def _analyze_upload(audio: UploadFile, min_speakers: Optional[int], max_speakers: Optional[int],
+                    lite: Optional[int], language: Optional[str]) -> dict:
+    tmp_path = None
+    try:
+        # Save uploaded file to temp location
+        suffix = os.path.splitext(audio.filename or "audio.wav")[1] or ".wav"
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir="/tmp") as tmp:
+            shutil.copyfileobj(audio.file, tmp)
+            tmp_path = tmp.name
+
+        is_lite = bool(lite)
+        print(f"[UPLOAD] Received {audio.filename}, saved to {tmp_path} ({os.path.getsize(tmp_path)} bytes), lite={is_lite}, language={language}", flush=True)
+        return _analyze_audio(tmp_path, min_speakers=min_speakers, max_speakers=max_speakers, lite=is_lite, language=language)
+    except HTTPException:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        return {"error": "whisperx_internal_error", "message": str(e)}
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except Exception:
+                pass
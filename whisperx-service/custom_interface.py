@@ -12,6 +12,9 @@ class CustomEncoderWav2vec2Classifier(Pretrained):
       - avg_pool
       - output_mlp
       - label_encoder in hparams
+
+    Not used by app.py, which loads the model with EncoderClassifier and calls
+    classify_batch on in-memory clips.
     """
 
     def encode_batch(self, wavs, wav_lens=None, normalize=False):
@@ -49,7 +52,9 @@ class CustomEncoderWav2vec2Classifier(Pretrained):
         rel_length = torch.tensor([1.0])
 
         emb = self.encode_batch(batch, rel_length)
-        logits = self.mods.output_mlp(emb).squeeze(1) if logits_has_dim1(self.mods.output_mlp(emb)) else self.mods.output_mlp(emb)
+        logits = self.mods.output_mlp(emb)
+        if logits_has_dim1(logits):
+            logits = logits.squeeze(1)
         out_prob = self.hparams.softmax(logits)
 
         score, index = torch.max(out_prob, dim=-1)
@@ -0,0 +1,60 @@
+"""Batched speaker-model predictions must not depend on which clips share a batch."""
+import sys
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("whisperx")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import app  # noqa: E402
+
+
+class _UnmaskedClassifier:
+    """Stands in for the IEMOCAP encoder: ignores wav_lens, so padding shifts the output."""
+
+    def classify_batch(self, wavs, wav_lens=None):
+        mean = wavs.mean(dim=-1, keepdim=True)  # padded zeros count
+        out_prob = torch.cat([mean, 1 - mean], dim=-1)
+        score, index = out_prob.max(dim=-1)
+        return out_prob, score, index, ["hap" if m > 0.75 else "sad" for m in mean.squeeze(-1).tolist()]
+
+
+@pytest.fixture
+def fake_emotion_model(monkeypatch):
+    monkeypatch.setattr(app, "init_emotion_model_if_needed", lambda: (True, None))
+    monkeypatch.setattr(app, "_emotion_clf", _UnmaskedClassifier())
+    app._clip_cache.clear()
+    yield
+    app._clip_cache.clear()
+
+
+def test_batched_emotions_match_per_clip(fake_emotion_model):
+    sr = 16000
+    clips = [
+        np.ones(2 * sr, dtype=np.float32),
+        np.full(25 * sr, 0.9, dtype=np.float32),
+        np.full(25 * sr, 0.6, dtype=np.float32),
+        np.ones(5 * sr, dtype=np.float32),
+    ]
+
+    batched = app.predict_emotions(clips, sr=sr)
+    app._clip_cache.clear()
+    single = [app.predict_emotions([y], sr=sr)[0] for y in clips]
+
+    assert batched == single
+    assert [label for label, _ in batched] == ["happy", "happy", "sad", "happy"]
+
+
+def test_by_length_groups_equal_lengths():
+    calls = []
+
+    def predict(batch):
+        calls.append([len(y) for y in batch])
+        return [len(y) for y in batch]
+
+    clips = [np.zeros(n, dtype=np.float32) for n in (3, 5, 3, 7, 5)]
+    assert app._by_length(clips, predict) == [3, 5, 3, 7, 5]
+    assert sorted(calls) == [[3, 3], [5, 5], [7]]
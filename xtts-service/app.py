@@ -14,17 +14,37 @@ import os
 # IMPORTANT: Accept Coqui TOS before importing TTS
 os.environ["COQUI_TOS_AGREED"] = "1"
 
-# Optimize CPU threading - use 2 threads for balance of speed and CPU usage
-os.environ["OMP_NUM_THREADS"] = "2"
-os.environ["MKL_NUM_THREADS"] = "2"
 
-import io
+def _default_num_threads() -> int:
+    """Physical cores, capped at 4 — XTTS CPU inference gains little beyond that."""
+    try:
+        import psutil
+        physical = psutil.cpu_count(logical=False)
+    except ImportError:
+        physical = None
+    if not physical:
+        physical = max(1, (os.cpu_count() or 2) // 2)  # assume SMT siblings
+    return max(1, min(4, physical))
+
+
+# CPU threading: must be exported before torch is imported to reach OMP/MKL
+XTTS_NUM_THREADS = int(os.getenv("XTTS_NUM_THREADS") or _default_num_threads())
+os.environ["OMP_NUM_THREADS"] = str(XTTS_NUM_THREADS)
+os.environ["MKL_NUM_THREADS"] = str(XTTS_NUM_THREADS)
+
 import re
+import json
+import time
+import shutil
+import asyncio
 import uuid
 import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 import torch
@@ -45,9 +65,13 @@ _using_finetuned = False
 
 import torchaudio
 import numpy as np
+import soundfile as sf
+import soxr
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
+from safetensors.torch import load_file, save_file
+from transformers import LogitsProcessor, LogitsProcessorList
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -57,18 +81,82 @@ logger = logging.getLogger(__name__)
 STORAGE_PATH = Path(os.getenv("STORAGE_PATH", "/var/www/storage/app"))
 VOICES_PATH = Path(os.getenv("VOICES_PATH", "/app/voices"))
 CACHE_PATH = Path(os.getenv("CACHE_PATH", "/app/cache"))
+EMBEDDINGS_PATH = CACHE_PATH / "embeddings"  # persisted conditioning latents, survive restarts
 
 # Ensure directories exist
 VOICES_PATH.mkdir(parents=True, exist_ok=True)
 CACHE_PATH.mkdir(parents=True, exist_ok=True)
+EMBEDDINGS_PATH.mkdir(parents=True, exist_ok=True)
+
+# Max speaker embeddings held in memory; evicted ones reload from EMBEDDINGS_PATH
+XTTS_EMBED_CACHE_CAP = int(os.getenv("XTTS_EMBED_CACHE_CAP", "50"))
+
+
+class EmbeddingLRU:
+    """Bounded voice_id -> (gpt_cond_latent, speaker_embedding) map, least recently used out first."""
+
+    def __init__(self, capacity: int):
+        self._od: OrderedDict = OrderedDict()
+        self._cap = max(1, capacity)
+        self._lock = threading.Lock()  # the model worker writes while handlers on the loop read
+
+    def get(self, voice_id: str):
+        with self._lock:
+            entry = self._od.get(voice_id)
+            if entry is not None:
+                self._od.move_to_end(voice_id)
+            return entry
+
+    def put(self, voice_id: str, entry):
+        with self._lock:
+            self._od[voice_id] = entry
+            self._od.move_to_end(voice_id)
+            while len(self._od) > self._cap:
+                self._od.popitem(last=False)
+
+    def pop(self, voice_id: str):
+        with self._lock:
+            return self._od.pop(voice_id, None)
+
+    def __contains__(self, voice_id: str) -> bool:
+        with self._lock:
+            return voice_id in self._od
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._od)
+
 
 # Global model and cache
 xtts_model = None
-speaker_embeddings_cache = {}  # voice_id -> (gpt_cond_latent, speaker_embedding)
+speaker_embeddings_cache = EmbeddingLRU(XTTS_EMBED_CACHE_CAP)
+
+# Every model forward (synthesis, conditioning latents, precompute) queues for
+# this single worker, which owns the model: XTTS can't batch different requests
+# into one generate() (see synthesize_chunks), and running them side by side
+# would only split the same torch threads. The event loop never runs a forward.
+_model_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="xtts-model")
+
+
+async def run_on_model(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_model_worker, fn, *args)
 
 # Maximum characters per chunk for faster synthesis
 MAX_CHUNK_CHARS = 250
 
+# torch.compile the GPT token step and HiFi-GAN decoder (slow first call, opt-in)
+XTTS_COMPILE = os.getenv("XTTS_COMPILE", "0") == "1"
+
+# bf16 autocast for synthesis; the HiFi-GAN decoder is kept in fp32 (opt-in)
+XTTS_BF16 = os.getenv("XTTS_BF16", "0") == "1"
+_bf16_autocast = False
+
+# One fused temperature/top-k/top-p step per token instead of HF's three warpers
+XTTS_FUSED_SAMPLER = os.getenv("XTTS_FUSED_SAMPLER", "1") == "1"
+
+# int8 dynamic quantization of the GPT-2 transformer's linear layers, CPU only (opt-in)
+XTTS_INT8 = os.getenv("XTTS_INT8", "0") == "1"
+
 
 class SynthesizeRequest(BaseModel):
     text: str
@@ -79,9 +167,34 @@ class SynthesizeRequest(BaseModel):
     output_path: Optional[str] = None
 
 
+def _fp32_forward(forward, device_type: str):
+    """Wrap a forward so it runs with autocast off and floating inputs upcast to fp32."""
+    def _up(x):
+        return x.float() if torch.is_tensor(x) and x.is_floating_point() else x
+
+    def wrapped(*args, **kwargs):
+        with torch.autocast(device_type=device_type, enabled=False):
+            return forward(*map(_up, args), **{k: _up(v) for k, v in kwargs.items()})
+    return wrapped
+
+
+def _conv1d_to_linear(module):
+    """Swap HF GPT-2 Conv1D layers for equivalent nn.Linear so quantize_dynamic picks them up."""
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            linear = torch.nn.Linear(*child.weight.shape)  # Conv1D stores (in, out)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+
 def load_xtts_model():
     """Load XTTS model (fine-tuned if XTTS_FINETUNED_DIR is set, else base)."""
-    global xtts_model, _using_finetuned
+    global xtts_model, _using_finetuned, _bf16_autocast
 
     if xtts_model is not None:
         return xtts_model
@@ -163,14 +276,63 @@ def load_xtts_model():
             _using_finetuned = False
 
         if torch.cuda.is_available():
+            # Every chunk has a different length, so cuDNN autotuning would
+            # re-benchmark on nearly every call instead of paying off.
+            torch.backends.cudnn.benchmark = False
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
             xtts_model.cuda()
             logger.info(f"XTTS loaded on GPU: {torch.cuda.get_device_name(0)}")
         else:
-            torch.set_num_threads(2)
-            logger.info("XTTS loaded on CPU")
+            torch.set_num_threads(XTTS_NUM_THREADS)
+            try:
+                torch.set_num_interop_threads(1)
+            except RuntimeError:
+                pass  # can only be set before the first inter-op parallel work
+            logger.info(f"XTTS loaded on CPU ({XTTS_NUM_THREADS} threads)")
 
         xtts_model.eval()
         torch.set_grad_enabled(False)
+
+        int8 = False
+        if XTTS_INT8:
+            if torch.cuda.is_available():
+                logger.warning("XTTS_INT8 only applies on CPU; ignoring it on GPU")
+            else:
+                # Only the token-loop transformer: the conditioning encoder shares
+                # model.gpt and its latents are cached, and HiFi-GAN is conv-heavy.
+                # gpt_inference holds the same transformer object, so in-place
+                # swaps reach it too.
+                transformer = xtts_model.gpt.gpt
+                _conv1d_to_linear(transformer)
+                torch.ao.quantization.quantize_dynamic(
+                    transformer, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+                )
+                int8 = True
+                logger.info("XTTS GPT transformer quantized to int8")
+
+        if XTTS_BF16 and int8:
+            logger.warning("XTTS_BF16 ignored: int8 quantized layers do not run under autocast")
+        elif XTTS_BF16:
+            if torch.cuda.is_available() and not torch.cuda.is_bf16_supported():
+                logger.warning("XTTS_BF16 set but this GPU has no bf16 support; staying in fp32")
+            else:
+                # Weights stay fp32: the conditioning encoder lives in model.gpt
+                # and the cached latents must not depend on this flag.
+                decoder = xtts_model.hifigan_decoder
+                decoder.forward = _fp32_forward(decoder.forward, xtts_model.device.type)
+                _bf16_autocast = True
+                logger.info("XTTS synthesis runs under bf16 autocast (HiFi-GAN in fp32)")
+
+        if XTTS_COMPILE:
+            # Compile the bound forwards rather than wrapping the modules: HF
+            # generate() calls gpt_inference through its own self, so a wrapped
+            # module would only ever see its (unused) outer forward.
+            gpt_inference = xtts_model.gpt.gpt_inference
+            gpt_inference.forward = torch.compile(gpt_inference.forward, dynamic=True)
+            decoder = xtts_model.hifigan_decoder
+            decoder.forward = torch.compile(decoder.forward, dynamic=True)
+            logger.info("XTTS GPT and HiFi-GAN forwards wrapped with torch.compile")
         return xtts_model
 
     except Exception as e:
@@ -178,12 +340,35 @@ def load_xtts_model():
         raise
 
 
-def get_speaker_embedding(voice_id: str):
-    """Get cached speaker embedding or compute it."""
-    global speaker_embeddings_cache
+def _sample_fingerprint(sample_path: Path, block: int = 64 * 1024) -> str:
+    """Cheap content hash: size plus the first and last 64KB of the sample."""
+    size = sample_path.stat().st_size
+    h = hashlib.blake2b(str(size).encode(), digest_size=8)
+    with open(sample_path, "rb") as f:
+        h.update(f.read(block))
+        if size > block:
+            f.seek(max(block, size - block))
+            h.update(f.read(block))
+    return h.hexdigest()
+
+
+def _embedding_file(voice_id: str, sample_path: Path) -> Path:
+    # The sample fingerprint is part of the name, so re-recording a voice's
+    # sample.wav misses the old file instead of reusing stale latents.
+    return EMBEDDINGS_PATH / f"{voice_id}_{_sample_fingerprint(sample_path)}.safetensors"
 
-    if voice_id in speaker_embeddings_cache:
-        return speaker_embeddings_cache[voice_id]
+
+def _drop_embedding_files(voice_id: str, keep: Optional[Path] = None):
+    for f in EMBEDDINGS_PATH.glob(f"{voice_id}_*.safetensors"):
+        if f != keep:
+            f.unlink(missing_ok=True)
+
+
+def get_speaker_embedding(voice_id: str):
+    """Get cached speaker embedding (memory, then disk) or compute it."""
+    cached = speaker_embeddings_cache.get(voice_id)
+    if cached is not None:
+        return cached
 
     voice_dir = VOICES_PATH / voice_id
     sample_path = voice_dir / "sample.wav"
@@ -192,6 +377,17 @@ def get_speaker_embedding(voice_id: str):
         raise ValueError(f"Voice sample not found: {voice_id}")
 
     model = load_xtts_model()
+    cache_file = _embedding_file(voice_id, sample_path)
+
+    if cache_file.exists():
+        try:
+            tensors = load_file(str(cache_file), device=str(model.device))
+            entry = (tensors["gpt"], tensors["spk"])
+            speaker_embeddings_cache.put(voice_id, entry)
+            logger.info(f"Speaker embedding loaded from disk for {voice_id}")
+            return entry
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable embedding cache {cache_file.name}: {e}")
 
     logger.info(f"Computing speaker embedding for {voice_id}...")
 
@@ -203,12 +399,40 @@ def get_speaker_embedding(voice_id: str):
             max_ref_length=30,
         )
 
-    speaker_embeddings_cache[voice_id] = (gpt_cond_latent, speaker_embedding)
+    speaker_embeddings_cache.put(voice_id, (gpt_cond_latent, speaker_embedding))
+    try:
+        save_file({"gpt": gpt_cond_latent.contiguous().cpu(), "spk": speaker_embedding.contiguous().cpu()}, str(cache_file))
+        _drop_embedding_files(voice_id, keep=cache_file)
+    except Exception as e:
+        logger.warning(f"Failed to persist speaker embedding for {voice_id}: {e}")
     logger.info(f"Speaker embedding cached for {voice_id}")
 
     return gpt_cond_latent, speaker_embedding
 
 
+def _voices_without_embeddings() -> List[str]:
+    pending = []
+    for voice_dir in sorted(VOICES_PATH.iterdir()):
+        sample_path = voice_dir / "sample.wav"
+        if sample_path.exists() and not _embedding_file(voice_dir.name, sample_path).exists():
+            pending.append(voice_dir.name)
+    return pending
+
+
+async def precompute_embeddings():
+    """Compute and persist latents for every voice that has no embedding file yet."""
+    pending = await asyncio.to_thread(_voices_without_embeddings)
+    if not pending:
+        return
+    logger.info(f"Precomputing speaker embeddings for {len(pending)} voice(s)")
+    for voice_id in pending:
+        # One worker job per voice, so requests queued meanwhile run in between
+        try:
+            await run_on_model(get_speaker_embedding, voice_id)
+        except Exception as e:
+            logger.warning(f"Failed to precompute embedding for {voice_id}: {e}")
+
+
 def normalize_uzbek_for_xtts(text: str) -> str:
     """
     Convert Uzbek special characters to Turkish equivalents for XTTS.
@@ -241,15 +465,35 @@ def normalize_uzbek_for_xtts(text: str) -> str:
     return text
 
 
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+_COMMA_RE = re.compile(r',\s*')
+
+
 def split_text_into_chunks(text: str, max_chars: int = MAX_CHUNK_CHARS) -> List[str]:
     """Split text into smaller chunks for faster synthesis."""
-    # Split by sentences first
-    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
-
     chunks = []
-    current_chunk = ""
+    # The chunk being built is kept as pieces (separators included) plus its
+    # length, and only joined when emitted, instead of re-formatting it per word.
+    pieces: List[str] = []
+    size = 0
+
+    def add(piece: str, sep: str):
+        nonlocal size
+        if pieces:
+            pieces.append(sep)
+            size += len(sep)
+        pieces.append(piece)
+        size += len(piece)
+
+    def flush():
+        nonlocal size
+        if pieces:
+            chunks.append("".join(pieces))
+            pieces.clear()
+            size = 0
 
-    for sentence in sentences:
+    # Split by sentences first
+    for sentence in _SENTENCE_RE.split(text.strip()):
         sentence = sentence.strip()
         if not sentence:
             continue
@@ -257,43 +501,117 @@ def split_text_into_chunks(text: str, max_chars: int = MAX_CHUNK_CHARS) -> List[
         # If single sentence is too long, split by commas or force split
         if len(sentence) > max_chars:
             # Try splitting by commas
-            parts = re.split(r',\s*', sentence)
-            for part in parts:
+            for part in _COMMA_RE.split(sentence):
                 part = part.strip()
                 if not part:
                     continue
-                if len(current_chunk) + len(part) + 2 <= max_chars:
-                    current_chunk = f"{current_chunk}, {part}".strip(", ")
+                if size + len(part) + 2 <= max_chars:
+                    add(part, ", ")
                 else:
-                    if current_chunk:
-                        chunks.append(current_chunk)
+                    flush()
                     # Force split if still too long
                     if len(part) > max_chars:
-                        words = part.split()
-                        current_chunk = ""
-                        for word in words:
-                            if len(current_chunk) + len(word) + 1 <= max_chars:
-                                current_chunk = f"{current_chunk} {word}".strip()
-                            else:
-                                if current_chunk:
-                                    chunks.append(current_chunk)
-                                current_chunk = word
+                        for word in part.split():
+                            if size + len(word) + 1 > max_chars:
+                                flush()
+                            add(word, " ")
                     else:
-                        current_chunk = part
+                        add(part, ", ")
         else:
-            if len(current_chunk) + len(sentence) + 1 <= max_chars:
-                current_chunk = f"{current_chunk} {sentence}".strip()
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = sentence
+            if size + len(sentence) + 1 > max_chars:
+                flush()
+            add(sentence, " ")
 
-    if current_chunk:
-        chunks.append(current_chunk)
+    flush()
 
     return chunks if chunks else [text[:max_chars]]
 
 
+# Base parameters tuned for natural speech
+_BASE_EMOTION_PARAMS = {
+    "temperature": 0.7,
+    "length_penalty": 1.0,
+    "repetition_penalty": 2.0,
+    "top_k": 50,
+    "top_p": 0.85,
+    "speed_mult": 1.0,
+}
+
+# Emotion configs tuned for more expressive, natural delivery
+# More differentiated parameters for distinct emotional signatures
+_EMOTION_CONFIGS = {
+    # Happy: Warm, slightly faster, more melodic variation
+    "happy": {
+        "temperature": 0.82,
+        "top_p": 0.88,
+        "speed_mult": 1.08,
+        "length_penalty": 0.92,
+        "repetition_penalty": 1.8,
+    },
+    # Excited: High energy, faster, more pitch variation
+    "excited": {
+        "temperature": 0.88,
+        "top_p": 0.92,
+        "speed_mult": 1.15,
+        "length_penalty": 0.85,
+        "repetition_penalty": 1.7,
+    },
+    # Sad: Slower, more monotone, heavier
+    "sad": {
+        "temperature": 0.55,
+        "top_p": 0.75,
+        "speed_mult": 0.85,
+        "length_penalty": 1.15,
+        "repetition_penalty": 2.2,
+    },
+    # Angry: Intense, clipped, forceful
+    "angry": {
+        "temperature": 0.78,
+        "top_p": 0.85,
+        "speed_mult": 1.12,
+        "length_penalty": 0.88,
+        "repetition_penalty": 2.5,
+    },
+    # Fear: Faster, breathier, urgent
+    "fear": {
+        "temperature": 0.8,
+        "top_p": 0.88,
+        "speed_mult": 1.18,
+        "length_penalty": 0.85,
+        "repetition_penalty": 2.0,
+    },
+    # Surprise: Quick onset, varied
+    "surprise": {
+        "temperature": 0.85,
+        "top_p": 0.9,
+        "speed_mult": 1.1,
+        "length_penalty": 0.9,
+        "repetition_penalty": 1.8,
+    },
+    # Disgust: Slower, lower, dismissive
+    "disgust": {
+        "temperature": 0.6,
+        "top_p": 0.78,
+        "speed_mult": 0.92,
+        "length_penalty": 1.05,
+        "repetition_penalty": 2.3,
+    },
+    # Neutral: Natural, conversational
+    "neutral": {
+        "temperature": 0.7,
+        "top_p": 0.85,
+        "speed_mult": 1.0,
+        "length_penalty": 1.0,
+        "repetition_penalty": 2.0,
+    },
+}
+
+# Resolved once at import; get_emotion_params is on every /synthesize
+_EMOTION_PARAMS = {
+    name: {**_BASE_EMOTION_PARAMS, **config} for name, config in _EMOTION_CONFIGS.items()
+}
+
+
 def get_emotion_params(emotion: str) -> dict:
     """
     Get synthesis parameters based on emotion for expressive, natural speech.
@@ -306,117 +624,89 @@ def get_emotion_params(emotion: str) -> dict:
     - repetition_penalty: Prevents word/phrase repetition
     """
     emotion = emotion.lower() if emotion else "neutral"
+    return dict(_EMOTION_PARAMS.get(emotion, _BASE_EMOTION_PARAMS))
 
-    # Base parameters tuned for natural speech
-    params = {
-        "temperature": 0.7,
-        "length_penalty": 1.0,
-        "repetition_penalty": 2.0,
-        "top_k": 50,
-        "top_p": 0.85,
-        "speed_mult": 1.0,
-    }
-
-    # Emotion configs tuned for more expressive, natural delivery
-    # More differentiated parameters for distinct emotional signatures
-    emotion_configs = {
-        # Happy: Warm, slightly faster, more melodic variation
-        "happy": {
-            "temperature": 0.82,
-            "top_p": 0.88,
-            "speed_mult": 1.08,
-            "length_penalty": 0.92,
-            "repetition_penalty": 1.8,
-        },
-        # Excited: High energy, faster, more pitch variation
-        "excited": {
-            "temperature": 0.88,
-            "top_p": 0.92,
-            "speed_mult": 1.15,
-            "length_penalty": 0.85,
-            "repetition_penalty": 1.7,
-        },
-        # Sad: Slower, more monotone, heavier
-        "sad": {
-            "temperature": 0.55,
-            "top_p": 0.75,
-            "speed_mult": 0.85,
-            "length_penalty": 1.15,
-            "repetition_penalty": 2.2,
-        },
-        # Angry: Intense, clipped, forceful
-        "angry": {
-            "temperature": 0.78,
-            "top_p": 0.85,
-            "speed_mult": 1.12,
-            "length_penalty": 0.88,
-            "repetition_penalty": 2.5,
-        },
-        # Fear: Faster, breathier, urgent
-        "fear": {
-            "temperature": 0.8,
-            "top_p": 0.88,
-            "speed_mult": 1.18,
-            "length_penalty": 0.85,
-            "repetition_penalty": 2.0,
-        },
-        # Surprise: Quick onset, varied
-        "surprise": {
-            "temperature": 0.85,
-            "top_p": 0.9,
-            "speed_mult": 1.1,
-            "length_penalty": 0.9,
-            "repetition_penalty": 1.8,
-        },
-        # Disgust: Slower, lower, dismissive
-        "disgust": {
-            "temperature": 0.6,
-            "top_p": 0.78,
-            "speed_mult": 0.92,
-            "length_penalty": 1.05,
-            "repetition_penalty": 2.3,
-        },
-        # Neutral: Natural, conversational
-        "neutral": {
-            "temperature": 0.7,
-            "top_p": 0.85,
-            "speed_mult": 1.0,
-            "length_penalty": 1.0,
-            "repetition_penalty": 2.0,
-        },
-    }
 
-    if emotion in emotion_configs:
-        params.update(emotion_configs[emotion])
-
-    return params
+class FusedSamplingWarper(LogitsProcessor):
+    """Temperature, top-k and top-p in one pass over the k best logits.
 
+    HF applies these as separate warpers, and its top-p sorts the whole
+    vocabulary every token. Here top-p works on the top-k values topk already
+    returns sorted; the result matches HF's chain apart from ties at the k-th logit.
+    """
 
-def synthesize_chunk(model, text: str, gpt_cond_latent, speaker_embedding, language: str, speed: float, emotion: str = "neutral") -> torch.Tensor:
-    """Synthesize a single chunk of text with emotion-aware parameters."""
+    def __init__(self, temperature: float, top_k: int, top_p: float):
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+
+    def __call__(self, input_ids, scores):
+        values, indices = torch.topk(scores / self.temperature, min(self.top_k, scores.size(-1)))
+        probs = values.softmax(dim=-1)
+        # Drop a candidate once the mass of the ones ranked above it reaches top_p
+        values = values.masked_fill(probs.cumsum(dim=-1) - probs >= self.top_p, -float("inf"))
+        return torch.full_like(scores, -float("inf")).scatter_(-1, indices, values)
+
+
+def compile_warmup(model):
+    """Run one short synthesis so torch.compile traces before the first real request."""
+    voice_dir = next((d for d in sorted(VOICES_PATH.iterdir()) if (d / "sample.wav").exists()), None)
+    if voice_dir is None:
+        logger.info("No voices yet; torch.compile will trace on the first request")
+        return
+    gpt_cond_latent, speaker_embedding = get_speaker_embedding(voice_dir.name)
+    for _ in synthesize_chunks(model, ["Salom dunyo."], gpt_cond_latent, speaker_embedding, "uz", 1.0):
+        pass
+    logger.info("torch.compile warmup done")
+
+
+def synthesize_chunks(model, texts: List[str], gpt_cond_latent, speaker_embedding, language: str, speed: float, emotion: str = "neutral") -> Iterator[torch.Tensor]:
+    """Synthesize a request's text chunks with emotion-aware parameters.
+
+    Yields each chunk's waveform as soon as it is ready, so callers can write it
+    out instead of holding the whole utterance.
+
+    Sampling parameters and conditioning are resolved once for the whole batch.
+    Chunks still go through the GPT one at a time: XTTS's GPT2 inference wrapper
+    stores one unmasked prefix embedding per call, so padding chunks of
+    different lengths into one generate() would change what each one conditions on.
+    """
     # Get emotion-specific parameters
     emo_params = get_emotion_params(emotion)
-    final_speed = speed * emo_params["speed_mult"]
-
-    with torch.inference_mode():
-        out = model.inference(
-            text=text,
-            language=language,
-            gpt_cond_latent=gpt_cond_latent,
-            speaker_embedding=speaker_embedding,
-            speed=final_speed,
-            temperature=emo_params["temperature"],
-            length_penalty=emo_params["length_penalty"],
-            repetition_penalty=emo_params["repetition_penalty"],
-            top_k=emo_params["top_k"],
-            top_p=emo_params["top_p"],
-            enable_text_splitting=False,  # We handle splitting ourselves
+    inference_kwargs = dict(
+        language=language,
+        gpt_cond_latent=gpt_cond_latent.to(model.device),
+        speaker_embedding=speaker_embedding.to(model.device),
+        speed=speed * emo_params["speed_mult"],
+        temperature=emo_params["temperature"],
+        length_penalty=emo_params["length_penalty"],
+        repetition_penalty=emo_params["repetition_penalty"],
+        top_k=emo_params["top_k"],
+        top_p=emo_params["top_p"],
+        enable_text_splitting=False,  # We handle splitting ourselves
+    )
+    if XTTS_FUSED_SAMPLER:
+        # Neutral values switch HF's own warpers off; ours runs after the
+        # repetition penalty like they did.
+        inference_kwargs.update(
+            temperature=1.0, top_k=0, top_p=1.0,
+            logits_processor=LogitsProcessorList([FusedSamplingWarper(
+                emo_params["temperature"], emo_params["top_k"], emo_params["top_p"]
+            )]),
         )
-    wav = out["wav"]
-    # Ensure it's a tensor
-    if isinstance(wav, np.ndarray):
-        wav = torch.from_numpy(wav)
-    return wav
+
+    autocast = torch.autocast(model.device.type, dtype=torch.bfloat16, enabled=_bf16_autocast)
+
+    for i, text in enumerate(texts):
+        logger.info(f"  Chunk {i+1}/{len(texts)}: {len(text)} chars")
+        # Grad/autocast state is entered per chunk so it never leaks into the
+        # caller while the generator is suspended.
+        with torch.inference_mode(), autocast:
+            wav = model.inference(text=text, **inference_kwargs)["wav"]
+        # Ensure it's a tensor
+        if isinstance(wav, np.ndarray):
+            wav = torch.from_numpy(wav)
+        yield wav
 
 
 @asynccontextmanager
@@ -424,10 +714,15 @@ async def lifespan(app: FastAPI):
     """Preload model on startup."""
     logger.info("XTTS Service starting - preloading model...")
     try:
-        load_xtts_model()
+        model = await run_on_model(load_xtts_model)
         logger.info("Model preloaded successfully")
+        if XTTS_COMPILE:
+            await run_on_model(compile_warmup, model)
     except Exception as e:
         logger.warning(f"Model preload failed (will load on first request): {e}")
+    else:
+        # Off the startup path; voices with a cached file are loaded lazily
+        app.state.precompute = asyncio.create_task(precompute_embeddings())
     yield
     logger.info("XTTS Service shutting down...")
 
@@ -446,26 +741,31 @@ async def health():
         "torch_version": torch.__version__,
         "cuda_available": torch.cuda.is_available(),
         "cached_voices": len(speaker_embeddings_cache),
+        "num_threads": torch.get_num_threads(),
+        "num_interop_threads": torch.get_num_interop_threads(),
     }
 
 
 @app.get("/ready")
 async def ready():
     try:
-        model = load_xtts_model()
+        await run_on_model(load_xtts_model)
         return {"status": "ready", "model": "xtts_v2_optimized", "device": "cpu"}
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Model not ready: {e}")
 
 
-@app.get("/voices")
-async def list_voices():
+# /voices is polled by the UI; rescan the voices directory at most this often
+VOICES_LIST_TTL = float(os.getenv("XTTS_VOICES_LIST_TTL", "5"))
+_voices_listing = (0.0, [])  # (monotonic time of scan, voice metadata)
+
+
+def _scan_voices() -> List[dict]:
     voices = []
     for voice_dir in VOICES_PATH.iterdir():
         if voice_dir.is_dir():
             sample_file = voice_dir / "sample.wav"
             if sample_file.exists():
-                import json
                 meta_file = voice_dir / "meta.json"
                 meta = {}
                 if meta_file.exists():
@@ -477,9 +777,51 @@ async def list_voices():
                     "description": meta.get("description", ""),
                     "language": meta.get("language", "multi"),
                     "created_at": meta.get("created_at", ""),
-                    "cached": voice_dir.name in speaker_embeddings_cache,
                 })
-    return {"voices": voices}
+    return voices
+
+
+def _invalidate_voices_listing():
+    global _voices_listing
+    _voices_listing = (0.0, [])
+
+
+@app.get("/voices")
+async def list_voices():
+    global _voices_listing
+    scanned_at, voices = _voices_listing
+    if time.monotonic() - scanned_at > VOICES_LIST_TTL:
+        voices = await asyncio.to_thread(_scan_voices)
+        _voices_listing = (time.monotonic(), voices)
+    # "cached" is live state, so it is filled in per request rather than cached
+    return {"voices": [
+        {**v, "cached": v["voice_id"] in speaker_embeddings_cache} for v in voices
+    ]}
+
+
+def _store_sample(src, sample_path: Path):
+    """Copy an upload to disk in chunks, then decode it to a 22.05 kHz mono sample."""
+    upload_path = sample_path.with_name("upload")
+    try:
+        with open(upload_path, "wb") as f:
+            shutil.copyfileobj(src, f, 1024 * 1024)
+        audio_tensor, sr = torchaudio.load(str(upload_path))
+    finally:
+        upload_path.unlink(missing_ok=True)
+
+    # Mono, then resample to 22050Hz (soxr needs no per-request filter setup)
+    channels = audio_tensor.shape[0]
+    if channels == 1:
+        y = audio_tensor[0]  # view, no copy
+    elif channels == 2:
+        y = audio_tensor[0].add(audio_tensor[1]).mul_(0.5)
+    else:
+        y = audio_tensor.mean(dim=0)
+    y = y.numpy()
+    if sr != 22050:
+        y = soxr.resample(y, sr, 22050, quality="HQ")
+
+    sf.write(str(sample_path), y, 22050, subtype="PCM_16")
 
 
 @app.post("/clone")
@@ -490,28 +832,14 @@ async def clone_voice(
     language: str = Form("uz"),
 ):
     try:
-        voice_id = hashlib.md5(f"{name}_{uuid.uuid4()}".encode()).hexdigest()[:16]
+        voice_id = uuid.uuid4().hex[:16]
         voice_dir = VOICES_PATH / voice_id
         voice_dir.mkdir(parents=True, exist_ok=True)
 
         sample_path = voice_dir / "sample.wav"
-        audio_bytes = await audio.read()
-
-        audio_tensor, sr = torchaudio.load(io.BytesIO(audio_bytes))
-
-        # Resample to 22050Hz
-        if sr != 22050:
-            resampler = torchaudio.transforms.Resample(sr, 22050)
-            audio_tensor = resampler(audio_tensor)
-
-        # Mono
-        if audio_tensor.shape[0] > 1:
-            audio_tensor = torch.mean(audio_tensor, dim=0, keepdim=True)
-
-        torchaudio.save(str(sample_path), audio_tensor, 22050)
+        await asyncio.to_thread(_store_sample, audio.file, sample_path)
 
         # Save metadata
-        import json
         from datetime import datetime
         meta = {
             "name": name,
@@ -521,10 +849,11 @@ async def clone_voice(
         }
         with open(voice_dir / "meta.json", "w") as f:
             json.dump(meta, f, indent=2)
+        _invalidate_voices_listing()
 
         # Pre-cache the embedding
         try:
-            get_speaker_embedding(voice_id)
+            await run_on_model(get_speaker_embedding, voice_id)
         except Exception as e:
             logger.warning(f"Failed to pre-cache embedding: {e}")
 
@@ -537,15 +866,53 @@ async def clone_voice(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# "uz" stays "uz" — tokenizer monkey-patch maps it to "tr" internally.
+# For base model, fall back to "tr" since "uz" may not be in its config.
+LANG_MAP = {
+    "uz": "uz",  # fine-tuned model trained with lang="uz" directly
+    "ru": "ru", "en": "en", "tr": "tr",
+    "ar": "ar", "zh": "zh-cn", "ja": "ja", "ko": "ko",
+    "es": "es", "fr": "fr", "de": "de", "it": "it",
+}
+
+def synthesize_to_file(request: SynthesizeRequest, output_path: Path) -> int:
+    """Synthesize a request into output_path; returns the number of chunks."""
+    model = load_xtts_model()
+
+    # Get cached speaker embedding
+    gpt_cond_latent, speaker_embedding = get_speaker_embedding(request.voice_id)
+
+    language = LANG_MAP.get(request.language, "en")
+
+    text = request.text
+
+    # Split into chunks
+    chunks = split_text_into_chunks(text)
+    logger.info(f"Synthesizing {len(chunks)} chunks for voice={request.voice_id}")
+
+    # Synthesize all chunks with emotion
+    emotion = request.emotion or "neutral"
+    logger.info(f"Synthesizing with emotion: {emotion}")
+
+    # Append each chunk to the output as it is synthesized
+    try:
+        with sf.SoundFile(str(output_path), "w", samplerate=24000, channels=1, subtype="PCM_16") as fout:
+            for wav in synthesize_chunks(
+                model, chunks, gpt_cond_latent, speaker_embedding,
+                language, request.speed, emotion
+            ):
+                fout.write(wav.cpu().numpy())
+    except BaseException:
+        output_path.unlink(missing_ok=True)  # don't leave a truncated wav behind
+        raise
+
+    return len(chunks)
+
+
 @app.post("/synthesize")
 async def synthesize(request: SynthesizeRequest):
     """Fast chunked synthesis."""
     try:
-        model = load_xtts_model()
-
-        # Get cached speaker embedding
-        gpt_cond_latent, speaker_embedding = get_speaker_embedding(request.voice_id)
-
         if request.output_path:
             output_path = STORAGE_PATH / request.output_path
             output_path.parent.mkdir(parents=True, exist_ok=True)
@@ -554,51 +921,15 @@ async def synthesize(request: SynthesizeRequest):
             output_path = CACHE_PATH / f"{uuid.uuid4()}.wav"
             cleanup_output = True
 
-        # "uz" stays "uz" — tokenizer monkey-patch maps it to "tr" internally.
-        # For base model, fall back to "tr" since "uz" may not be in its config.
-        lang_map = {
-            "uz": "uz",  # fine-tuned model trained with lang="uz" directly
-            "ru": "ru", "en": "en", "tr": "tr",
-            "ar": "ar", "zh": "zh-cn", "ja": "ja", "ko": "ko",
-            "es": "es", "fr": "fr", "de": "de", "it": "it",
-        }
-        language = lang_map.get(request.language, "en")
-
-        text = request.text
-
-        # Split into chunks
-        chunks = split_text_into_chunks(text)
-        logger.info(f"Synthesizing {len(chunks)} chunks for voice={request.voice_id}")
-
-        # Synthesize each chunk with emotion
-        audio_segments = []
-        emotion = request.emotion or "neutral"
-        logger.info(f"Synthesizing with emotion: {emotion}")
-
-        for i, chunk in enumerate(chunks):
-            logger.info(f"  Chunk {i+1}/{len(chunks)}: {len(chunk)} chars")
-            wav = synthesize_chunk(
-                model, chunk, gpt_cond_latent, speaker_embedding,
-                language, request.speed, emotion
-            )
-            audio_segments.append(wav)
-
-        # Concatenate all chunks
-        if len(audio_segments) == 1:
-            final_wav = audio_segments[0]
-        else:
-            final_wav = torch.cat(audio_segments, dim=0)
-
-        # Save output
-        torchaudio.save(str(output_path), final_wav.unsqueeze(0), 24000)
+        n_chunks = await run_on_model(synthesize_to_file, request, output_path)
 
         if not output_path.exists() or output_path.stat().st_size < 1000:
             raise HTTPException(status_code=500, detail="Synthesis produced invalid output")
 
-        logger.info(f"Synthesis complete: {output_path} ({len(chunks)} chunks)")
+        logger.info(f"Synthesis complete: {output_path} ({n_chunks} chunks)")
 
         headers = {
-            "X-Chunks": str(len(chunks)),
+            "X-Chunks": str(n_chunks),
             "X-Size": str(output_path.stat().st_size),
         }
         if request.output_path:
@@ -606,7 +937,6 @@ async def synthesize(request: SynthesizeRequest):
 
         # Return audio bytes; schedule temp file cleanup if needed
         if cleanup_output:
-            import asyncio
             response = FileResponse(
                 str(output_path),
                 media_type="audio/wav",
@@ -652,7 +982,7 @@ async def download_file(path: str):
 async def warmup_voice(voice_id: str):
     """Pre-cache a voice embedding."""
     try:
-        get_speaker_embedding(voice_id)
+        await run_on_model(get_speaker_embedding, voice_id)
         return {"ok": True, "voice_id": voice_id, "cached": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -664,11 +994,12 @@ async def delete_voice(voice_id: str):
     if not voice_dir.exists():
         raise HTTPException(status_code=404, detail="Voice not found")
 
-    import shutil
     shutil.rmtree(voice_dir)
 
     # Remove from cache
-    speaker_embeddings_cache.pop(voice_id, None)
+    speaker_embeddings_cache.pop(voice_id)
+    _drop_embedding_files(voice_id)
+    _invalidate_voices_listing()
 
     return {"ok": True}
 